@@ -29,7 +29,7 @@ except ImportError:
     RANDOM_ENGAGE_MIN_MINUTES = 5
     RANDOM_ENGAGE_MAX_MINUTES = 10
 
-from personality.memory_long import Long_Term_Memory
+from personality.memory_long import get_long_term_memory
 from reminders import ReminderStore, reminder_loop
 from trust import trust
 from commands import handle_commands
@@ -219,7 +219,7 @@ async def on_message(message: discord.Message) -> None:
             content,
             store=store,
             default_tz=DEFAULT_TZ,
-            LongMemory=Long_Term_Memory,
+            LongMemory=get_long_term_memory,
         )
         if handled:
             return
@@ -11,7 +11,7 @@ import discord
 from ai import ask_llama, analyze_nlp
 from config import EMOTION_ENABLED, HUMANIZE_ENABLED
 from emotion import emotion
-from personality.memory_long import Long_Term_Memory
+from personality.memory_long import get_long_term_memory
 from personality.memory_short import get_short_memory
 from triggers import analyze_input
 from trust import trust
@@ -77,7 +77,7 @@ async def handle_ai_conversation(
     try:
         # --- Per-user memory ---
         short_memory = get_short_memory(user_id)
-        long_memory = Long_Term_Memory(user_id)
+        long_memory = get_long_term_memory(user_id)
         
         # --- Trust context (per-user) ---
         tstyle = None
@@ -186,7 +186,7 @@ async def handle_ai_conversation(
         
         # Periodically extract structured facts/episodes in the background
         try:
-            asyncio.create_task(asyncio.to_thread(long_memory.maybe_extract, ask_llama))
+            asyncio.create_task(long_memory.extract_in_background(ask_llama))
         except Exception:
             pass
 
@@ -211,7 +211,7 @@ async def handle_ai_conversation(
         
         # Optional: auto-voice replies
         try:
-            await maybe_auto_voice_reply(message, reply, Long_Term_Memory)
+            await maybe_auto_voice_reply(message, reply, get_long_term_memory)
         except Exception as e:
             log(f"[Voice] Failed: {e}")
         
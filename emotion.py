@@ -21,12 +21,15 @@ The public API remains compatible with earlier code:
 from __future__ import annotations
 
 from dataclasses import dataclass
+from functools import lru_cache
 import math
 import time
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, Tuple
 
+__all__ = ["Affect", "EmotionEngine", "emotion"]
 
-@dataclass
+
+@dataclass(slots=True)
 class Affect:
     """A small affect vector.
 
@@ -38,6 +41,76 @@ class Affect:
     dominance: float = 0.0  # powerless (-) <-> in-control (+)
 
 
+# -------------------------
+# Guidance
+# -------------------------
+
+_GUIDANCE: Dict[str, str] = {
+    "furious": "Very annoyed. Short, blunt replies. Avoid emojis.",
+    "irritated": "Irritated and impatient. Keep it brief; avoid rambling.",
+    "tense": "Slightly tense. Be direct and helpful; de-escalate.",
+    "cold": "Colder and more distant. Dry tone, minimal fluff.",
+    "neutral": "Calm and neutral. Clear and direct.",
+    "calm": "Calm and steady. Helpful and grounded.",
+    "friendly": "Friendly and engaged. Light warmth.",
+    "upbeat": "Upbeat and expressive. A little playful is OK.",
+    "playful": "Playful and energetic. Emojis are OK, but don't spam.",
+}
+
+
+@lru_cache(maxsize=128)
+def _format_description(label: str, v: float, a: float, d: float) -> str:
+    """Build the prompt description for a (label, quantized V/A/D) tuple."""
+    return (
+        f"Mood: {label}. Guidance: {_GUIDANCE.get(label, _GUIDANCE['neutral'])} "
+        f"(valence={v:+.2f}, arousal={a:+.2f}, dominance={d:+.2f})"
+    )
+
+
+# -------------------------
+# Batch replay
+# -------------------------
+
+def _replay_events(dts, dvs, das, dds, confs, emo, base) -> None:
+    """Fold (dt, dv, da, dd, confidence) events into `emo`/`base` in place.
+
+    Same math as decay() + apply() with exact exponential decay. Written in the
+    subset Numba can compile, so the loop runs natively when it is available.
+    """
+    for i in range(len(dts)):
+        dt = dts[i] if dts[i] > 0.0 else 0.0
+        fast = math.exp(-1.2 * dt / 30.0)
+        slow = math.exp(-0.25 * dt / 300.0)
+        conf = confs[i]
+        alpha = 0.45 * conf + 0.10
+        base_alpha = 0.04 * conf
+        for j in range(3):
+            delta = dvs[i] if j == 0 else (das[i] if j == 1 else dds[i])
+            x = emo[j] * fast + alpha * delta
+            x = -1.0 if x < -1.0 else (1.0 if x > 1.0 else x)
+            emo[j] = x
+            b = base[j] * slow
+            base[j] = b + base_alpha * (x - b)
+
+
+# Numba is optional; compile lazily so importing emotion.py stays cheap.
+_replay_kernel = None
+
+
+def _get_replay_kernel():
+    """Return the JIT-compiled replay kernel, or None if numba/numpy are missing."""
+    global _replay_kernel
+    if _replay_kernel is None:
+        try:
+            import numba
+            import numpy as np
+        except ImportError:
+            _replay_kernel = False
+        else:
+            _replay_kernel = (numba.njit(cache=True, fastmath=True)(_replay_events), np)
+    return _replay_kernel or None
+
+
 class EmotionEngine:
     """Affect engine with a fast emotion layer + slow mood baseline.
 
@@ -56,17 +129,7 @@ class EmotionEngine:
         self._last_update = time.time()
 
         # Guidance table (small & readable)
-        self._guidance: Dict[str, str] = {
-            "furious": "Very annoyed. Short, blunt replies. Avoid emojis.",
-            "irritated": "Irritated and impatient. Keep it brief; avoid rambling.",
-            "tense": "Slightly tense. Be direct and helpful; de-escalate.",
-            "cold": "Colder and more distant. Dry tone, minimal fluff.",
-            "neutral": "Calm and neutral. Clear and direct.",
-            "calm": "Calm and steady. Helpful and grounded.",
-            "friendly": "Friendly and engaged. Light warmth.",
-            "upbeat": "Upbeat and expressive. A little playful is OK.",
-            "playful": "Playful and energetic. Emojis are OK, but don't spam.",
-        }
+        self._guidance: Dict[str, str] = _GUIDANCE
 
     # -------------------------
     # Core ops
@@ -74,19 +137,14 @@ class EmotionEngine:
 
     @staticmethod
     def _clampf(x: float, lo: float = -1.0, hi: float = 1.0) -> float:
-        return max(lo, min(hi, float(x)))
+        x = float(x)
+        return lo if x < lo else (hi if x > hi else x)
 
     def _clamp_affect(self, a: Affect) -> None:
         a.valence = self._clampf(a.valence)
         a.arousal = self._clampf(a.arousal)
         a.dominance = self._clampf(a.dominance)
 
-    @staticmethod
-    def _mix(current: float, target: float, alpha: float) -> float:
-        """Inertia/smoothing: alpha=0 keeps current, alpha=1 jumps to target."""
-        alpha = max(0.0, min(1.0, float(alpha)))
-        return (1.0 - alpha) * current + alpha * target
-
     def apply(self, delta: int | Dict[str, Any]) -> None:
         """Apply an affect delta.
 
@@ -117,17 +175,22 @@ class EmotionEngine:
         # Faster response when confidence is high.
         alpha = 0.45 * conf + 0.10
 
-        self._emotion.valence = self._mix(self._emotion.valence, self._emotion.valence + dv, alpha)
-        self._emotion.arousal = self._mix(self._emotion.arousal, self._emotion.arousal + da, alpha)
-        self._emotion.dominance = self._mix(self._emotion.dominance, self._emotion.dominance + dd, alpha)
-        self._clamp_affect(self._emotion)
-
-        # Very slow baseline learning (a rolling average of recent emotion)
+        # Lerp toward (x + dx): (1 - alpha) * x + alpha * (x + dx) == x + alpha * dx.
+        e = self._emotion
+        v = e.valence + alpha * dv
+        a = e.arousal + alpha * da
+        d = e.dominance + alpha * dd
+        e.valence = -1.0 if v < -1.0 else (1.0 if v > 1.0 else v)
+        e.arousal = -1.0 if a < -1.0 else (1.0 if a > 1.0 else a)
+        e.dominance = -1.0 if d < -1.0 else (1.0 if d > 1.0 else d)
+
+        # Very slow baseline learning (a rolling average of recent emotion).
+        # base_alpha <= 0.04 and both layers stay in [-1, 1], so no clamp needed.
         base_alpha = 0.04 * conf
-        self._baseline.valence = self._mix(self._baseline.valence, self._emotion.valence, base_alpha)
-        self._baseline.arousal = self._mix(self._baseline.arousal, self._emotion.arousal, base_alpha)
-        self._baseline.dominance = self._mix(self._baseline.dominance, self._emotion.dominance, base_alpha)
-        self._clamp_affect(self._baseline)
+        b = self._baseline
+        b.valence += base_alpha * (e.valence - b.valence)
+        b.arousal += base_alpha * (e.arousal - b.arousal)
+        b.dominance += base_alpha * (e.dominance - b.dominance)
 
     def set(self, value: int) -> None:
         """Force the *overall* mood value (legacy API).
@@ -147,6 +210,38 @@ class EmotionEngine:
         self._baseline = Affect()
         self._last_update = time.time()
 
+    def replay(self, events: Iterable[Tuple[float, float, float, float, float]]) -> None:
+        """Rebuild state from an event log, starting from neutral.
+
+        Each event is (dt_seconds, valence, arousal, dominance, confidence), where
+        dt is the gap since the previous event. Uses a Numba kernel when available
+        (large logs); online updates should keep using apply().
+        """
+        events = list(events)
+        emo = [0.0, 0.0, 0.0]
+        base = [0.0, 0.0, 0.0]
+        if events:
+            dts, dvs, das, dds, confs = (
+                [float(x) for x in col] for col in zip(*events)
+            )
+            confs = [max(0.0, min(1.0, c)) for c in confs]
+            jit = _get_replay_kernel()
+            if jit is not None:
+                kernel, np = jit
+                emo_a = np.zeros(3)
+                base_a = np.zeros(3)
+                kernel(
+                    np.asarray(dts), np.asarray(dvs), np.asarray(das),
+                    np.asarray(dds), np.asarray(confs), emo_a, base_a,
+                )
+                emo, base = emo_a.tolist(), base_a.tolist()
+            else:
+                _replay_events(dts, dvs, das, dds, confs, emo, base)
+
+        self._emotion = Affect(*emo)
+        self._baseline = Affect(*base)
+        self._last_update = time.time()
+
     def decay(self, step: int = 1) -> None:
         """Time-based decay toward neutral.
 
@@ -154,6 +249,9 @@ class EmotionEngine:
         """
         now = time.time()
         dt = max(0.0, now - self._last_update)
+        if dt < 0.05:
+            # Imperceptible; leave _last_update alone so the gap accumulates.
+            return
         self._last_update = now
 
         # Fast layer decays quicker than baseline.
@@ -163,8 +261,13 @@ class EmotionEngine:
         k_slow = 0.25 * step
 
         # Exponential-ish decay: x <- x * exp(-k * dt)
-        fast_factor = math.exp(-k_fast * dt / 30.0)   # ~30s time constant
-        slow_factor = math.exp(-k_slow * dt / 300.0)  # ~5min time constant
+        if dt < 1.0:
+            # First-order Taylor of exp(-x) is well within 2% for sub-second gaps.
+            fast_factor = max(0.0, 1.0 - k_fast * dt / 30.0)
+            slow_factor = max(0.0, 1.0 - k_slow * dt / 300.0)
+        else:
+            fast_factor = math.exp(-k_fast * dt / 30.0)   # ~30s time constant
+            slow_factor = math.exp(-k_slow * dt / 300.0)  # ~5min time constant
 
         self._emotion.valence *= fast_factor
         self._emotion.arousal *= fast_factor
@@ -173,9 +276,7 @@ class EmotionEngine:
         self._baseline.valence *= slow_factor
         self._baseline.arousal *= slow_factor
         self._baseline.dominance *= slow_factor
-
-        self._clamp_affect(self._emotion)
-        self._clamp_affect(self._baseline)
+        # Factors are in [0, 1], so both layers stay within [-1, 1]; no clamp needed.
 
     # -------------------------
     # Introspection / prompt text
@@ -234,17 +335,17 @@ class EmotionEngine:
         Prompt-safe description for system injection.
         Keep this as instructions, not roleplay text.
         """
-        label = self.label()
-        guidance = self._guidance.get(label, self._guidance["neutral"])
-
         # Expose a small amount of numeric context (helps the system prompt be stable).
+        # Values are quantized to 0.02 so repeat moods reuse the formatted string.
         v = self._overall_valence()
         a = self._overall_arousal()
         d = self._clampf(self._baseline.dominance + 0.50 * self._emotion.dominance)
 
-        return (
-            f"Mood: {label}. Guidance: {guidance} "
-            f"(valence={v:+.2f}, arousal={a:+.2f}, dominance={d:+.2f})"
+        return _format_description(
+            self.label(),
+            round(v * 50) / 50,
+            round(a * 50) / 50,
+            round(d * 50) / 50,
         )
 
     def metrics(self) -> Dict[str, float]:
@@ -4,7 +4,8 @@ from __future__ import annotations
 import random
 import re
 from dataclasses import dataclass
-from typing import Optional, Callable, Any
+from functools import lru_cache
+from typing import Optional, Callable, Any, Sequence
 
 import json
 import os
@@ -22,28 +23,20 @@ LISTENING_RATE = 0.85
 # Max one follow-up question, and only when ambiguity is detected
 FOLLOWUP_RATE = 0.45
 
-# Never show debug-like listening labels in user-facing text
-LISTENING_LABEL_PREFIXES = (
-    "listening line:",
-    "listening:",
-)
+# Precompiled patterns (hot path: every apply_human_layer call)
+# Never show debug-like listening labels ("Listening:", "Listening line:") in user-facing text
+_LISTENING_PREFIX_RE = re.compile(r"^\s*listening(?:\s+line)?\s*:\s*", re.IGNORECASE)
+_TINY_ACK_RE = re.compile(r"(ok|okay|thx|thanks|ty|nice|cool)\.?!!?\??")
+_ALREADY_LISTENED_RE = re.compile(r"^(yep|yeah|sure|got it|gotcha|okay|alright|for sure|no worries)\b")
+_PRONOUN_RE = re.compile(r"\b(it|that|this|they|them)\b")
+_MAKE_IT_RE = re.compile(r"\b(make|change|fix|update)\s+it\b")
+
 
 def strip_listening_label(s: str) -> str:
     """Remove any accidental 'Listening line:' style prefix from the start of a line."""
     if not s:
         return s
-    lines = s.splitlines()
-    if not lines:
-        return s
-    first = lines[0].lstrip()
-    low = first.lower()
-    for p in LISTENING_LABEL_PREFIXES:
-        if low.startswith(p):
-            # Drop the prefix and following whitespace/punctuation
-            first = re.sub(r"(?i)^listening(\s+line)?\s*:\s*", "", first).lstrip()
-            lines[0] = first
-            break
-    return "\n".join(lines).strip()
+    return _LISTENING_PREFIX_RE.sub("", s, count=1).strip()
 
 
 
@@ -53,7 +46,10 @@ def emit_thought(trace: dict[str, Any], logger: Callable[[str], None] | None = N
     This deliberately avoids logging raw user text or the full reply. It logs only the
     internal signals and decisions this module actually uses.
     """
-    line = json.dumps(trace, ensure_ascii=False, separators=(",", ":"))
+    _emit_line(json.dumps(trace, ensure_ascii=False, separators=(",", ":")), logger)
+
+
+def _emit_line(line: str, logger: Callable[[str], None] | None) -> None:
     if logger is not None:
         logger(line)
         return
@@ -61,7 +57,23 @@ def emit_thought(trace: dict[str, Any], logger: Callable[[str], None] | None = N
     print(line, file=sys.stderr, flush=True)
 
 
-@dataclass
+# Fixed-schema thought pattern, same bytes as emit_thought() would produce. Every
+# string field comes from a small closed set of identifiers, so nothing needs escaping.
+_THOUGHT_PATTERN_FMT = (
+    '{{"module":"humanize","event":"thought_pattern",'
+    '"constants":{{"DETERMINISTIC":{det},"LISTENING_RATE":{listen_rate},"FOLLOWUP_RATE":{followup_rate}}},'
+    '"signals":{{"intent":{intent},"constraints_count":{constraints_count},"ambiguous":{ambiguous},'
+    '"style_bucket":"{style_bucket}","energy_bucket":"{energy_bucket}"}},'
+    '"decisions":{{"listen_eligible":{listen_eligible},"reply_already_listening":{reply_already_listening},'
+    '"used_listening_line":{used_listening_line},"added_followup":{added_followup}}}}}'
+)
+
+
+def _json_flag(v: Optional[bool]) -> str:
+    return "null" if v is None else ("true" if v else "false")
+
+
+@dataclass(slots=True, frozen=True)
 class Style:
     relax: float = 0.4          # 0..1 from trust style
     mood_label: str = "neutral" # from emotion.label()
@@ -70,89 +82,216 @@ class Style:
     dominance: float = 0.0
 
 
-def _rng() -> random.Random:
-    if DETERMINISTIC:
-        return random.Random(1337)
-    return random  # type: ignore[return-value]
+# RNG draws bound once at import. The deterministic stream is seeded once and then
+# advances normally (re-seeding per call would replay the same first draw forever).
+_RNG = random.Random(1337) if DETERMINISTIC else random  # type: ignore[assignment]
+_rng: Callable[[], float] = _RNG.random
+_choice: Callable[[Sequence[str]], str] = _RNG.choice
 
 
-def infer_intent(user_text: str) -> str:
-    t = (user_text or "").strip().lower()
+# Intent prefixes in priority order (first match wins).
+_INTENT_PREFIXES = (
+    ("explain", ("why", "how come", "what causes")),
+    ("how_to", ("how", "how do i", "how would", "what’s the best way", "whats the best way")),
+    ("request_change", ("can you", "could you", "please", "add ", "make ", "change ", "update ", "remove ")),
+)
+
+# Same rules bucketed by first character, so only a couple of prefixes are tried.
+_INTENT_BY_FIRST_CHAR: dict[str, tuple[tuple[str, str], ...]] = {}
+for _intent, _prefixes in _INTENT_PREFIXES:
+    for _p in _prefixes:
+        _INTENT_BY_FIRST_CHAR[_p[0]] = _INTENT_BY_FIRST_CHAR.get(_p[0], ()) + ((_p, _intent),)
+del _intent, _prefixes, _p
+
+
+@lru_cache(maxsize=1024)
+def _intent_of(t: str) -> str:
+    """infer_intent() on text that is already stripped + lowercased."""
     if not t:
         return "general"
-    if t.startswith(("why", "how come", "what causes")):
-        return "explain"
-    if t.startswith(("how", "how do i", "how would", "what’s the best way", "whats the best way")):
-        return "how_to"
-    if t.startswith(("can you", "could you", "please", "add ", "make ", "change ", "update ", "remove ")):
-        return "request_change"
+    for prefix, intent in _INTENT_BY_FIRST_CHAR.get(t[0], ()):
+        if t.startswith(prefix):
+            return intent
     if t.endswith("?"):
         return "question"
     return "general"
 
 
-def extract_constraints(user_text: str) -> list[str]:
-    """Tiny heuristic constraint extractor (fast + good-enough)."""
-    t = (user_text or "").lower()
-    out: list[str] = []
+def infer_intent(user_text: str) -> str:
+    return _intent_of((user_text or "").strip().lower())
+
+
+# Constraint + ambiguity-target keywords -> flag bits, matched in one pass over the text.
+_KW_P225 = 1 << 0
+_KW_DEEP = 1 << 1
+_KW_WARM = 1 << 2
+_KW_CODE = 1 << 3
+_KW_NO_FILE = 1 << 4
+_KW_SAME_LINE = 1 << 5
+_KW_MOOD_OR_CONSOLE = 1 << 6
+_KW_AMBIG_TARGET = 1 << 7
 
+_CONSTRAINT_KEYWORDS = {
     # Voice / TTS common constraints (you can expand this list)
-    if "p225" in t:
+    "p225": _KW_P225,
+    "deeper": _KW_DEEP,
+    "deep": _KW_DEEP,
+    "lower": _KW_DEEP,
+    "warmer": _KW_WARM,
+    "warm": _KW_WARM,
+    # Output preference
+    "code": _KW_CODE,
+    "not files": _KW_NO_FILE,
+    "not file": _KW_NO_FILE,
+    "no file": _KW_NO_FILE,
+    # Logging preference
+    "same line": _KW_SAME_LINE,
+    "mood": _KW_MOOD_OR_CONSOLE,
+    "console": _KW_MOOD_OR_CONSOLE,
+}
+
+# Topics that make a pronoun-only request ("fix it") unambiguous.
+_AMBIG_TARGETS = ("tts", "voice", "pitch", "speed", "warmup", "log", "command", "module")
+
+
+def _keyword_bits() -> dict[str, int]:
+    bits = dict(_CONSTRAINT_KEYWORDS)
+    for k in _AMBIG_TARGETS:
+        bits[k] = bits.get(k, 0) | _KW_AMBIG_TARGET
+    # The scan only reports the longest keyword starting at each position, so a
+    # keyword also carries the bits of every shorter keyword it starts with
+    # ("warmup" -> warm + target, "deeper" -> deep).
+    merged: dict[str, int] = {}
+    for k in bits:
+        v = 0
+        for j, jv in bits.items():
+            if k.startswith(j):
+                v |= jv
+        merged[k] = v
+    return merged
+
+
+_KEYWORD_BITS = _keyword_bits()
+
+# Zero-width lookahead so overlapping keywords are all seen (same as `kw in t`).
+_KEYWORD_SCAN_RE = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in sorted(_KEYWORD_BITS, key=len, reverse=True)) + "))"
+)
+
+
+@lru_cache(maxsize=512)
+def _keyword_flags(t: str) -> int:
+    """Bitmask of every constraint / ambiguity-target keyword in lowercased text."""
+    flags = 0
+    for m in _KEYWORD_SCAN_RE.finditer(t):
+        flags |= _KEYWORD_BITS[m.group(1)]
+    return flags
+
+
+@lru_cache(maxsize=512)
+def _constraints_of(t: str) -> tuple[str, ...]:
+    """extract_constraints() on text that is already lowercased (cached, immutable)."""
+    flags = _keyword_flags(t)
+    if not flags & ~_KW_AMBIG_TARGET:
+        return ()
+
+    out: list[str] = []
+    if flags & _KW_P225:
         out.append("keep p225")
-    if "deeper" in t or "deep" in t or "lower" in t:
+    if flags & _KW_DEEP:
         out.append("make it deeper")
-    if "warm" in t or "warmer" in t:
+    if flags & _KW_WARM:
         out.append("make it warmer")
-
-    # Output preference
-    if "code" in t and ("not file" in t or "no file" in t or "not files" in t):
+    if flags & _KW_CODE and flags & _KW_NO_FILE:
         out.append("show code only")
-
-    # Logging preference
-    if "same line" in t and ("mood" in t or "console" in t):
+    if flags & _KW_SAME_LINE and flags & _KW_MOOD_OR_CONSOLE:
         out.append("log in the same console line")
+    return tuple(out)
+
+
+def extract_constraints(user_text: str) -> list[str]:
+    """Tiny heuristic constraint extractor (fast + good-enough)."""
+    return list(_constraints_of((user_text or "").lower()))
+
+
+class PreparedText:
+    """User text normalized once and shared by every signal in the layer.
+
+    intent/constraints/ambiguous are computed on first access, so branches that
+    never need them (e.g. no listening line, reply already asks a question) skip
+    the scans entirely.
+    """
 
-    # De-dup while preserving order
-    seen = set()
-    uniq: list[str] = []
-    for c in out:
-        if c not in seen:
-            uniq.append(c)
-            seen.add(c)
-    return uniq
+    __slots__ = ("raw", "stripped", "lower", "_intent", "_constraints", "_ambiguous")
 
+    def __init__(self, user_text: str):
+        self.raw = user_text or ""
+        self.stripped = self.raw.strip()
+        self.lower = self.stripped.lower()
+        self._intent: Optional[str] = None
+        self._constraints: Optional[tuple[str, ...]] = None
+        self._ambiguous: Optional[bool] = None
 
-def should_listen(user_text: str) -> bool:
+    @property
+    def intent(self) -> str:
+        if self._intent is None:
+            self._intent = _intent_of(self.lower)
+        return self._intent
+
+    @property
+    def constraints(self) -> tuple[str, ...]:
+        if self._constraints is None:
+            self._constraints = _constraints_of(self.lower)
+        return self._constraints
+
+    @property
+    def ambiguous(self) -> bool:
+        if self._ambiguous is None:
+            self._ambiguous = _ambiguous_of(self.lower)
+        return self._ambiguous
+
+
+def prepare(user_text: str) -> PreparedText:
+    """Strip/lowercase the user text once; derived signals are filled in lazily."""
+    return PreparedText(user_text)
+
+
+def should_listen(text: PreparedText) -> bool:
     """Skip listening line for tiny messages to avoid sounding repetitive."""
-    t = (user_text or "").strip()
-    if len(t) < 6:
+    n = len(text.stripped)
+    if n < 6:
         return False
-    if re.fullmatch(r"(ok|okay|thx|thanks|ty|nice|cool)\.?!!?\??", t.lower()):
+    # The longest possible ack ("thanks.!!?") is 10 chars; skip the regex beyond that.
+    if n <= 10 and _TINY_ACK_RE.fullmatch(text.lower):
         return False
-    return _rng().random() < LISTENING_RATE
+    return _rng() < LISTENING_RATE
+
+
+# Opener pools keyed by every intent _intent_of() can return, built once.
+# _OPENERS_RELAXED adds the casual extras to each pool.
+_OPENERS_HOWTO = ("Yep—can do.", "Sure.", "Alright.", "Okay, got you.")
+_OPENERS: dict[str, tuple[str, ...]] = {
+    "how_to": _OPENERS_HOWTO,
+    "request_change": _OPENERS_HOWTO,
+    "explain": ("Yep.", "Got you.", "Makes sense.", "Okay—here’s what’s happening."),
+    "question": ("Yep.", "Yeah.", "Totally.", "For sure."),
+    "general": ("Got it.", "Okay.", "Fair.", "Alright."),
+}
+_OPENERS_RELAXED: dict[str, tuple[str, ...]] = {
+    k: v + ("Yep.", "No worries.", "Gotcha.") for k, v in _OPENERS.items()
+}
 
 
-def listening_line(user_text: str, style: Style) -> str:
-    intent = infer_intent(user_text)
-    constraints = extract_constraints(user_text)
+def listening_line(text: PreparedText, style: Style) -> str:
+    intent = text.intent
+    constraints = text.constraints
 
     relaxed = style.relax >= 0.60
     low_energy = style.arousal < -0.15
     high_energy = style.arousal > 0.30
 
-    if intent in ("how_to", "request_change"):
-        openers = ["Yep—can do.", "Sure.", "Alright.", "Okay, got you."]
-    elif intent == "explain":
-        openers = ["Yep.", "Got you.", "Makes sense.", "Okay—here’s what’s happening."]
-    elif intent == "question":
-        openers = ["Yep.", "Yeah.", "Totally.", "For sure."]
-    else:
-        openers = ["Got it.", "Okay.", "Fair.", "Alright."]
-
-    if relaxed and _rng().random() < 0.35:
-        openers += ["Yep.", "No worries.", "Gotcha."]
-
-    opener = _rng().choice(openers)
+    pools = _OPENERS_RELAXED if relaxed and _rng() < 0.35 else _OPENERS
+    opener = _choice(pools[intent])
 
     if constraints:
         reflected = ", ".join(constraints[:2])
@@ -165,16 +304,22 @@ def listening_line(user_text: str, style: Style) -> str:
 
 
 
+def _style_block(tone: str) -> str:
+    return f"Reply style: {tone} Match the user's energy - short and snappy for casual, unhinged rants when things get exciting."
+
+
+# One prebuilt block per relax tier: strict, friendly, relaxed.
+_STYLE_BLOCKS = (
+    _style_block("Professional and neutral."),
+    _style_block("Friendly but direct."),
+    _style_block("Relaxed, casual, chaotic energy allowed."),
+)
+
+
 def system_style_block(style: Style) -> str:
     """Short, high-leverage system guidance appended via memory_short extras."""
-    if style.relax >= 0.70:
-        tone = "Relaxed, casual, chaotic energy allowed."
-    elif style.relax >= 0.35:
-        tone = "Friendly but direct."
-    else:
-        tone = "Professional and neutral."
-
-    return f"Reply style: {tone} Match the user's energy - short and snappy for casual, unhinged rants when things get exciting."
+    relax = style.relax
+    return _STYLE_BLOCKS[0 if relax < 0.35 else (1 if relax < 0.70 else 2)]
 
 
 
@@ -183,31 +328,33 @@ def system_style_block(style: Style) -> str:
 def looks_like_it_already_listened(reply: str) -> bool:
     if not reply:
         return False
-    first = reply.strip().splitlines()[0].strip()
-    return bool(re.match(r"^(yep|yeah|sure|got it|gotcha|okay|alright|for sure|no worries)\b", first.lower()))
+    # The pattern is anchored at the start, so only the first line matters.
+    first = reply.lstrip().split("\n", 1)[0]
+    return bool(_ALREADY_LISTENED_RE.match(first.lower()))
 
 
-def is_ambiguous(user_text: str) -> bool:
-    t = (user_text or "").strip().lower()
+@lru_cache(maxsize=512)
+def _ambiguous_of(t: str) -> bool:
+    """is_ambiguous() on text that is already stripped + lowercased."""
     if not t:
         return False
 
-    pronouny = bool(re.search(r"\b(it|that|this|they|them)\b", t))
-    has_target_keywords = any(k in t for k in ["tts", "voice", "pitch", "speed", "warmup", "log", "command", "module"])
+    if not (_PRONOUN_RE.search(t) or _MAKE_IT_RE.search(t)):
+        return False
 
-    if pronouny and not has_target_keywords:
-        return True
+    # Substring match on purpose: "logs", "voices", "commands" count as targets too.
+    # Shares the cached keyword scan with _constraints_of().
+    return not _keyword_flags(t) & _KW_AMBIG_TARGET
 
-    if re.search(r"\b(make|change|fix|update)\s+it\b", t) and not has_target_keywords:
-        return True
 
-    return False
+def is_ambiguous(user_text: str) -> bool:
+    return _ambiguous_of((user_text or "").strip().lower())
 
 
-def maybe_followup(user_text: str, style: Style) -> str:
-    if not is_ambiguous(user_text):
+def maybe_followup(text: PreparedText, style: Style) -> str:
+    if not text.ambiguous:
         return ""
-    if _rng().random() > FOLLOWUP_RATE:
+    if _rng() > FOLLOWUP_RATE:
         return ""
     return "Quick check: what part should I change—voice, logging, or commands?"
 
@@ -238,60 +385,56 @@ def apply_human_layer(
             )
         return out
 
-    # --- signals the layer actually uses ---
-    intent = infer_intent(user_text)
-    constraints = extract_constraints(user_text)
-    ambiguous = is_ambiguous(user_text)
-
-    listen_eligible = should_listen(user_text)
-    reply_already_listening = looks_like_it_already_listened(out)
+    # --- signals the layer actually uses (user text normalized once) ---
+    # Cheap gates first; intent/constraints/ambiguity are only computed by the
+    # branches that need them (unused signals stay None in the trace).
+    text = prepare(user_text)
+    listen_eligible = should_listen(text)
+    reply_already_listening: Optional[bool] = None
 
     # --- apply transforms ---
-    parts: list[str] = []
+    # `out` is already stripped and both add-ons are stripped one-liners, so the
+    # no-transform path returns `out` as-is and the rest is plain concatenation.
+    final = out
     used_listening_line = False
     added_followup = False
 
+    if listen_eligible:
+        # `out` is already stripped; only its first line can match.
+        first_line = out.split("\n", 1)[0]
+        reply_already_listening = bool(_ALREADY_LISTENED_RE.match(first_line.lower()))
     if listen_eligible and not reply_already_listening:
-        parts.append(strip_listening_label(listening_line(user_text, style)))
+        opener = strip_listening_label(listening_line(text, style))
+        if opener:
+            final = f"{opener}\n{out}"
         used_listening_line = True
 
-    parts.append(out)
-
-    if "?" not in out:
-        fu = maybe_followup(user_text, style)
+    # Only the tail matters: a reply that already asks something ends near a "?".
+    if "?" not in out[-200:]:
+        fu = maybe_followup(text, style)
         if fu:
-            parts.append(fu)
+            final = f"{final}\n{fu}"
             added_followup = True
 
-    final = "\n".join(parts).strip()
-
     if thought_trace:
         style_bucket = "relaxed" if style.relax >= 0.60 else ("neutral" if style.relax >= 0.35 else "strict")
         energy_bucket = "high" if style.arousal > 0.30 else ("low" if style.arousal < -0.15 else "mid")
 
-        emit_thought(
-            {
-                "module": "humanize",
-                "event": "thought_pattern",
-                "constants": {
-                    "DETERMINISTIC": bool(DETERMINISTIC),
-                    "LISTENING_RATE": LISTENING_RATE,
-                    "FOLLOWUP_RATE": FOLLOWUP_RATE,
-                },
-                "signals": {
-                    "intent": intent,
-                    "constraints_count": len(constraints),
-                    "ambiguous": ambiguous,
-                    "style_bucket": style_bucket,
-                    "energy_bucket": energy_bucket,
-                },
-                "decisions": {
-                    "listen_eligible": listen_eligible,
-                    "reply_already_listening": reply_already_listening,
-                    "used_listening_line": used_listening_line,
-                    "added_followup": added_followup,
-                },
-            },
+        _emit_line(
+            _THOUGHT_PATTERN_FMT.format(
+                det=_json_flag(bool(DETERMINISTIC)),
+                listen_rate=repr(float(LISTENING_RATE)),
+                followup_rate=repr(float(FOLLOWUP_RATE)),
+                intent="null" if text._intent is None else f'"{text._intent}"',
+                constraints_count="null" if text._constraints is None else len(text._constraints),
+                ambiguous=_json_flag(text._ambiguous),
+                style_bucket=style_bucket,
+                energy_bucket=energy_bucket,
+                listen_eligible=_json_flag(listen_eligible),
+                reply_already_listening=_json_flag(reply_already_listening),
+                used_listening_line=_json_flag(used_listening_line),
+                added_followup=_json_flag(added_followup),
+            ),
             thought_logger,
         )
 
@@ -16,12 +16,15 @@ Requires: Python standard library only (sqlite3).
 
 from __future__ import annotations
 
+import heapq
 import json
 import re
 import sqlite3
 import threading
 import time
+from collections import OrderedDict
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
@@ -42,15 +45,62 @@ def _get_vector_module():
     return _vector_module if _vector_module else None
 
 
+# Applied to every connection: WAL lets readers run alongside the writer and,
+# with synchronous=NORMAL, commits no longer fsync twice.
+_CONNECTION_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-65536;
+PRAGMA foreign_keys=ON;
+"""
+
+
+# Re-run the query planner's stats refresh every N logged messages.
+_OPTIMIZE_EVERY_N_MESSAGES = 1000
+
+
+def _configure_connection(conn: sqlite3.Connection) -> None:
+    try:
+        conn.executescript(_CONNECTION_PRAGMAS)
+    except sqlite3.Error:
+        # e.g. read-only filesystem: WAL can't be enabled, defaults still work
+        pass
+
+
+_WORD_RE = re.compile(r"[a-zA-Z0-9']{2,}")
+# redact(): Discord tokens (very rough heuristic) and common API key shapes
+_TOKEN_RE = re.compile(r"[MN][A-Za-z\d_-]{20,}\.[A-Za-z\d_-]{6,}\.[A-Za-z\d_-]{20,}")
+_SECRET_RE = re.compile(r"(?i)(api[_-]?key|secret|token|password)\s*[:=]\s*\S+")
+
+# Episode id -> token set for keyword scoring. Ids are AUTOINCREMENT and episode
+# text is never edited, so entries never go stale; the cap only bounds memory.
+_TOKEN_CACHE_MAX_SIZE = 4096
+
+# retrieve_relevant() results, keyed by the user's episode version so any insert
+# or prune invalidates them; the TTL covers writes from other processes.
+_RETRIEVAL_CACHE_MAX_SIZE = 512
+_RETRIEVAL_CACHE_TTL = 60.0
+
+
 def _norm_words(text: str) -> List[str]:
-    words = re.findall(r"[a-zA-Z0-9']{2,}", text.lower())
-    seen = set()
-    out: List[str] = []
-    for w in words:
-        if w not in seen:
-            out.append(w)
-            seen.add(w)
-    return out
+    """Distinct words (2+ chars, lowercased) in first-seen order."""
+    return list(dict.fromkeys(_WORD_RE.findall(text.lower())))
+
+
+@lru_cache(maxsize=1024)
+def _word_set(text: str) -> frozenset[str]:
+    """_norm_words() for callers that only need membership, without the ordering pass.
+
+    Cached: chat queries repeat a lot ("hi", "thanks", ...).
+    """
+    return frozenset(_WORD_RE.findall(text.lower()))
+
+
+def _score_then_ts(scored: Tuple[float, "Episode"]) -> Tuple[float, int]:
+    """heapq.nlargest key for (score, episode) pairs: ties go to the newer episode."""
+    return scored[0], scored[1].ts
 
 
 @dataclass
@@ -63,13 +113,45 @@ class Episode:
     importance: float
 
 
+# importance * 1.5 + recency (1.0 today, linearly down to 0.0 at 30 days old),
+# evaluated by SQLite. The single parameter is the current timestamp.
+_BASE_SCORE_SQL = "importance * 1.5 + MAX(0.0, MIN(1.0, 1.0 - (? - ts) / 2592000.0))"
+
+
+def _tags_to_str(tags: Iterable[str]) -> str:
+    return ", ".join([str(t).strip().lower() for t in tags if str(t).strip()])
+
+
+def _episode_embed_text(text: str, tags_str: str) -> str:
+    """Text an episode's embedding is computed from."""
+    return f"{text} {tags_str}".strip()
+
+
+def _episode_tokens_str(text: str, tags_str: str) -> str:
+    """Value of the episodes.tokens column: the keyword-scoring words, space-joined."""
+    return " ".join(_norm_words(f"{text} {tags_str}"))
+
+
+def _episode_from_row(row: sqlite3.Row) -> Episode:
+    return Episode(
+        id=int(row["id"]),
+        user_id=str(row["user_id"]),
+        ts=int(row["ts"]),
+        text=str(row["text"]),
+        tags=str(row["tags"]),
+        importance=float(row["importance"]),
+    )
+
+
 class SQLiteMemory:
     """
     One SQLite DB for all users.
 
     Note:
-    - discord.py typically runs in one event loop thread, so one connection is fine.
-    - if you later run extraction in a thread executor, make a separate connection per thread.
+    - every thread gets its own connection (see `conn`), so extraction running in
+      a thread executor doesn't share a connection with the event loop thread.
+    - the DB runs in WAL mode: reads take no lock and run alongside writes;
+      writes are serialized with `_lock`.
     """
 
     def __init__(self, db_path: str = "memory.db"):
@@ -78,14 +160,58 @@ class SQLiteMemory:
         if str(parent) != ".":
             parent.mkdir(parents=True, exist_ok=True)
 
-        # allow use from asyncio thread executors; serialize writes with a lock
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
-        self._lock = threading.Lock()
+        # One connection per thread (created on first use), tracked so close() can
+        # close them all. ":memory:" DBs are per-connection, so they share one.
+        self._tls = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        self._shared_conn: Optional[sqlite3.Connection] = (
+            self._connect() if self.db_path == ":memory:" else None
+        )
+        # Re-entrant so extract_and_store can hold it across one transaction of helper writes.
+        self._lock = threading.RLock()
         self._init_schema()
 
         # Per-user message counters for "extract every N messages"
         self._msg_counter: Dict[str, int] = {}
+        self._messages_since_optimize = 0
+        self._token_cache: Dict[int, frozenset[str]] = {}
+        # Rendered facts_as_prompt() per user; upsert_facts() drops the user's entry.
+        self._facts_prompt_cache: Dict[str, str] = {}
+        # Bumped on every episode insert/prune for the user (see _RETRIEVAL_CACHE_TTL).
+        self._episodes_version: Dict[str, int] = {}
+        # Read and written under self._lock: retrievals run on to_thread workers.
+        self._retrieval_cache: OrderedDict[Tuple[str, int, frozenset[str], int], Tuple[float, List[Episode]]] = OrderedDict()
+        # Users with an extraction running (extraction runs off the event loop
+        # via asyncio.to_thread, so a second trigger can arrive mid-flight).
+        self._extract_in_flight: set[str] = set()
+        self._extract_lock = threading.Lock()
+
+    # -------------------------
+    # Connections
+    # -------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread=False only so close() can close every thread's connection
+        # Every statement here is a fixed, parametrized string; 256 keeps all of them
+        # (plus the IN (...) variants) prepared.
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        _configure_connection(conn)
+        with self._conns_lock:
+            self._conns.append(conn)
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The calling thread's connection."""
+        if self._shared_conn is not None:
+            return self._shared_conn
+        conn = getattr(self._tls, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._tls.conn = conn
+        return conn
 
     # -------------------------
     # Schema
@@ -138,18 +264,114 @@ class SQLiteMemory:
 
         cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_ts ON messages(user_id, ts DESC)")
 
-        # Lightweight schema migration for older DBs (ALTER TABLE is additive).
-        cur.execute("PRAGMA table_info(episodes)")
-        existing = {str(r["name"]) for r in cur.fetchall()}
-        if "times_used" not in existing:
-            cur.execute("ALTER TABLE episodes ADD COLUMN times_used INTEGER NOT NULL DEFAULT 0")
-        if "last_used_ts" not in existing:
-            cur.execute("ALTER TABLE episodes ADD COLUMN last_used_ts INTEGER NOT NULL DEFAULT 0")
-        if "embedding" not in existing:
-            cur.execute("ALTER TABLE episodes ADD COLUMN embedding BLOB DEFAULT NULL")
+        # Lightweight schema migrations for older DBs (ALTER TABLE is additive),
+        # tracked in PRAGMA user_version so an up-to-date DB skips them entirely.
+        # Each `if version < N:` step ends by setting user_version to N.
+        cur.execute("PRAGMA user_version")
+        version = int(cur.fetchone()[0])
+        if version < 1:
+            # DBs from before user_version tracking may already have some of these.
+            cur.execute("PRAGMA table_info(episodes)")
+            existing = {str(r["name"]) for r in cur.fetchall()}
+            if "times_used" not in existing:
+                cur.execute("ALTER TABLE episodes ADD COLUMN times_used INTEGER NOT NULL DEFAULT 0")
+            if "last_used_ts" not in existing:
+                cur.execute("ALTER TABLE episodes ADD COLUMN last_used_ts INTEGER NOT NULL DEFAULT 0")
+            if "embedding" not in existing:
+                cur.execute("ALTER TABLE episodes ADD COLUMN embedding BLOB DEFAULT NULL")
+            cur.execute("PRAGMA user_version = 1")
+            version = 1
+        if version < 2:
+            # Keyword tokens stored at insert time (space-joined _norm_words of text + tags).
+            cur.execute("PRAGMA table_info(episodes)")
+            if "tokens" not in {str(r["name"]) for r in cur.fetchall()}:
+                cur.execute("ALTER TABLE episodes ADD COLUMN tokens TEXT DEFAULT NULL")
+            cur.execute("SELECT id, text, tags FROM episodes WHERE tokens IS NULL")
+            cur.executemany(
+                "UPDATE episodes SET tokens = ? WHERE id = ?",
+                [(_episode_tokens_str(r["text"], r["tags"]), int(r["id"])) for r in cur.fetchall()],
+            )
+            cur.execute("PRAGMA user_version = 2")
+            version = 2
+        if version < 3:
+            # Re-encode legacy float32 embeddings as unit-length int8 so find_similar
+            # scores them without per-query norms. Needs numpy; retried until available.
+            mv = _get_vector_module()
+            if mv:
+                cur.execute("SELECT id, embedding FROM episodes WHERE embedding IS NOT NULL")
+                legacy = []
+                while rows := cur.fetchmany(500):
+                    legacy.extend(
+                        (mv.embedding_to_blob(mv.blob_to_numpy(r["embedding"])), int(r["id"]))
+                        for r in rows
+                        if not mv.is_quantized_blob(r["embedding"])
+                    )
+                cur.executemany("UPDATE episodes SET embedding = ? WHERE id = ?", legacy)
+                cur.execute("PRAGMA user_version = 3")
+
+        self._fts = self._init_fts(cur)
 
         self.conn.commit()
 
+        # Fresh planner stats for the (user_id, ts) indexes after any migration.
+        self._optimize("PRAGMA optimize(0x10002)")
+
+    def _init_fts(self, cur: sqlite3.Cursor) -> bool:
+        """Full-text index over episodes.text/tags, kept in sync by triggers.
+
+        Returns False when this SQLite build has no FTS5; keyword retrieval then
+        falls back to scanning the most recent episodes.
+        """
+        try:
+            cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='episodes_fts'")
+            existed = cur.fetchone() is not None
+            cur.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS episodes_fts USING fts5(
+                    text, tags,
+                    content='episodes', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS episodes_ai AFTER INSERT ON episodes BEGIN
+                    INSERT INTO episodes_fts(rowid, text, tags) VALUES (new.id, new.text, new.tags);
+                END
+                """
+            )
+            cur.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS episodes_ad AFTER DELETE ON episodes BEGIN
+                    INSERT INTO episodes_fts(episodes_fts, rowid, text, tags)
+                    VALUES ('delete', old.id, old.text, old.tags);
+                END
+                """
+            )
+            # Only text/tags edits touch the index (usage tracking updates don't).
+            cur.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS episodes_au AFTER UPDATE OF text, tags ON episodes BEGIN
+                    INSERT INTO episodes_fts(episodes_fts, rowid, text, tags)
+                    VALUES ('delete', old.id, old.text, old.tags);
+                    INSERT INTO episodes_fts(rowid, text, tags) VALUES (new.id, new.text, new.tags);
+                END
+                """
+            )
+            if not existed:
+                # Index episodes stored before the FTS table existed.
+                cur.execute("INSERT INTO episodes_fts(episodes_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def _optimize(self, sql: str = "PRAGMA optimize") -> None:
+        try:
+            self.conn.execute(sql)
+        except sqlite3.Error:
+            pass
+
     # -------------------------
     # Housekeeping
     # -------------------------
@@ -157,56 +379,84 @@ class SQLiteMemory:
     def prune(self, user_id: int, *, keep_episodes: int = 600, keep_messages: int = 300) -> None:
         """Keep DB size bounded per user."""
         uid = str(user_id)
-        with self._lock:
+        # `with self.conn` commits on success and rolls back on error, so a failed
+        # write never leaves this thread's connection holding the write lock.
+        with self._lock, self.conn:
             cur = self.conn.cursor()
-            cur.execute(
-                """
-                DELETE FROM episodes
-                WHERE user_id=?
-                  AND id NOT IN (
-                    SELECT id FROM episodes WHERE user_id=? ORDER BY ts DESC LIMIT ?
-                  )
-                """,
-                (uid, uid, int(keep_episodes)),
-            )
-            cur.execute(
-                """
-                DELETE FROM messages
-                WHERE user_id=?
-                  AND id NOT IN (
-                    SELECT id FROM messages WHERE user_id=? ORDER BY ts DESC LIMIT ?
-                  )
-                """,
-                (uid, uid, int(keep_messages)),
-            )
-            self.conn.commit()
+            self._prune_table(cur, "episodes", uid, int(keep_episodes))
+            self._prune_table(cur, "messages", uid, int(keep_messages))
+        self._bump_episodes_version(uid)
+
+    @staticmethod
+    def _prune_table(cur: sqlite3.Cursor, table: str, uid: str, keep: int) -> None:
+        """Delete everything older than the user's `keep`-th newest row (ties by id).
+
+        The cutoff is one index seek on (user_id, ts DESC) instead of a NOT IN over
+        the kept ids; no cutoff row (fewer than `keep` rows) makes it a no-op.
+        """
+        if keep <= 0:
+            cur.execute(f"DELETE FROM {table} WHERE user_id=?", (uid,))
+            return
+        cur.execute(
+            f"""
+            DELETE FROM {table}
+            WHERE user_id=?
+              AND (ts, id) < (
+                SELECT ts, id FROM {table} WHERE user_id=? ORDER BY ts DESC, id DESC LIMIT 1 OFFSET ?
+              )
+            """,
+            (uid, uid, keep - 1),
+        )
 
     @staticmethod
     def redact(text: str) -> str:
         """Best-effort redaction to avoid storing secrets in memory."""
         t = (text or "")
         # Discord tokens (very rough heuristic)
-        t = re.sub(r"[MN][A-Za-z\d_-]{20,}\.[A-Za-z\d_-]{6,}\.[A-Za-z\d_-]{20,}", "[REDACTED_TOKEN]", t)
+        t = _TOKEN_RE.sub("[REDACTED_TOKEN]", t)
         # Common API key shapes
-        t = re.sub(r"(?i)(api[_-]?key|secret|token|password)\s*[:=]\s*\S+", r"\1=[REDACTED]", t)
+        t = _SECRET_RE.sub(r"\1=[REDACTED]", t)
         return t
 
     # -------------------------
     # Facts
     # -------------------------
 
-    def upsert_fact(self, user_id: int, key: str, value: str, confidence: float = 0.7) -> None:
+    def upsert_fact(
+        self,
+        user_id: int,
+        key: str,
+        value: str,
+        confidence: float = 0.7,
+        *,
+        ts: Optional[int] = None,
+        commit: bool = True,
+    ) -> None:
+        self.upsert_facts(user_id, [(key, value, confidence)], ts=ts, commit=commit)
+
+    def upsert_facts(
+        self,
+        user_id: int,
+        facts: Iterable[Tuple[str, str, float]],
+        *,
+        ts: Optional[int] = None,
+        commit: bool = True,
+    ) -> None:
+        """upsert_fact() for several (key, value, confidence) rows in one executemany."""
         uid = str(user_id)
-        key = key.strip().lower()
-        value = value.strip()
-        confidence = float(clamp(confidence, 0.0, 1.0))
+        ts = int(ts or now_ts())
+        rows = []
+        for key, value, confidence in facts:
+            key = key.strip().lower()
+            value = value.strip()
+            if key and value:
+                rows.append((uid, key, value, float(clamp(confidence, 0.0, 1.0)), ts))
 
-        if not key or not value:
+        if not rows:
             return
 
         with self._lock:
-            cur = self.conn.cursor()
-            cur.execute(
+            self.conn.executemany(
                 """
                 INSERT INTO facts(user_id, key, value, confidence, updated_ts)
                 VALUES(?, ?, ?, ?, ?)
@@ -215,19 +465,31 @@ class SQLiteMemory:
                   confidence=excluded.confidence,
                   updated_ts=excluded.updated_ts
                 """,
-                (uid, key, value, confidence, now_ts()),
+                rows,
             )
-            self.conn.commit()
+            self._facts_prompt_cache.pop(uid, None)
+            if commit:
+                self.conn.commit()
 
     def get_facts(self, user_id: int) -> Dict[str, str]:
         uid = str(user_id)
-        with self._lock:
-            cur = self.conn.cursor()
-            cur.execute("SELECT key, value FROM facts WHERE user_id=? ORDER BY updated_ts DESC", (uid,))
-            return {row["key"]: row["value"] for row in cur.fetchall()}
+        rows = self.conn.execute("SELECT key, value FROM facts WHERE user_id=? ORDER BY updated_ts DESC", (uid,))
+        return {row["key"]: row["value"] for row in rows}
 
     def facts_as_prompt(self, user_id: int) -> str:
-        facts = self.get_facts(user_id)
+        uid = str(user_id)
+        cached = self._facts_prompt_cache.get(uid)
+        if cached is not None:
+            return cached
+        # Render under the write lock so an upsert can't land between the read
+        # and the cache store (facts change every few messages, prompts every turn).
+        with self._lock:
+            rendered = self._render_facts(self.get_facts(user_id))
+            self._facts_prompt_cache[uid] = rendered
+        return rendered
+
+    @staticmethod
+    def _render_facts(facts: Dict[str, str]) -> str:
         if not facts:
             return ""
 
@@ -265,95 +527,187 @@ class SQLiteMemory:
         importance: float = 0.5,
         ts: Optional[int] = None,
         embed: bool = True,
+        embedding: Optional[List[float]] = None,
+        *,
+        commit: bool = True,
     ) -> None:
-        uid = str(user_id)
+        """Store a memory card.
+
+        Pass a precomputed `embedding` (e.g. from a batch call) to skip embedding here.
+        commit=False leaves the insert in the caller's open transaction.
+        """
         text = (text or "").strip()
         if not text:
             return
 
-        tags_str = ", ".join([str(t).strip().lower() for t in tags if str(t).strip()])
-        importance = float(clamp(importance, 0.0, 1.0))
-        ts = int(ts or now_ts())
-
-        # Generate embedding if enabled
-        embedding_blob: Optional[bytes] = None
-        if embed:
+        if not embedding and embed:
             mv = _get_vector_module()
             if mv:
-                embed_text = f"{text} {tags_str}".strip()
-                embedding = mv.embed_text(embed_text)
-                if embedding:
+                embedding = mv.embed_text(_episode_embed_text(text, _tags_to_str(tags)))
+
+        self.add_episodes(user_id, [(text, tags, importance, embedding)], ts=ts, commit=commit)
+
+    def add_episodes(
+        self,
+        user_id: int,
+        episodes: Iterable[Tuple[str, Iterable[str], float, Optional[List[float]]]],
+        *,
+        ts: Optional[int] = None,
+        commit: bool = True,
+    ) -> None:
+        """add_episode() for several (text, tags, importance, embedding) rows in one executemany.
+
+        Embeddings are stored as given (None leaves the row unembedded); nothing is embedded here.
+        """
+        uid = str(user_id)
+        ts = int(ts or now_ts())
+        mv = None
+        rows = []
+        for text, tags, importance, embedding in episodes:
+            text = (text or "").strip()
+            if not text:
+                continue
+            tags_str = _tags_to_str(tags)
+            embedding_blob: Optional[bytes] = None
+            if embedding:
+                mv = mv or _get_vector_module()
+                if mv:
                     embedding_blob = mv.embedding_to_blob(embedding)
+            rows.append((
+                uid, ts, text, tags_str, float(clamp(importance, 0.0, 1.0)),
+                embedding_blob, _episode_tokens_str(text, tags_str),
+            ))
+
+        if not rows:
+            return
 
         with self._lock:
-            cur = self.conn.cursor()
-            cur.execute(
-                "INSERT INTO episodes(user_id, ts, text, tags, importance, embedding) VALUES(?, ?, ?, ?, ?, ?)",
-                (uid, ts, text, tags_str, importance, embedding_blob),
+            self.conn.executemany(
+                "INSERT INTO episodes(user_id, ts, text, tags, importance, embedding, tokens) VALUES(?, ?, ?, ?, ?, ?, ?)",
+                rows,
             )
-            self.conn.commit()
+            if commit:
+                self.conn.commit()
+                self._bump_episodes_version(uid)
 
-    def _fetch_candidate_episodes(self, user_id: int, limit: int = 120) -> List[Episode]:
+    def _fetch_candidate_episodes(
+        self, user_id: int, now: int, limit: int = 120
+    ) -> List[Tuple[float, Episode, Optional[str]]]:
+        """Most recent episodes as (importance + recency score, episode, stored tokens)."""
         uid = str(user_id)
-        with self._lock:
+        cur = self.conn.cursor()
+        cur.execute(
+            f"""
+            SELECT id, user_id, ts, text, tags, importance, tokens, {_BASE_SCORE_SQL} AS base_score
+            FROM episodes WHERE user_id=? ORDER BY ts DESC LIMIT ?
+            """,
+            (int(now), uid, int(limit)),
+        )
+        rows = cur.fetchall()
+        return [(float(row["base_score"]), _episode_from_row(row), row["tokens"]) for row in rows]
+
+    def _fetch_matching_episodes(
+        self, user_id: int, words: Iterable[str], now: int, limit: int = 40
+    ) -> Optional[List[Tuple[float, Episode, Optional[str]]]]:
+        """Best matches for any of `words` via the FTS index (None if unavailable).
+
+        Candidates are preselected in SQL by BM25 relevance plus the same
+        importance/recency score the final ranking uses, so a popular word can't
+        push important or recent matches out of the LIMIT.
+
+        Rows are shaped like _fetch_candidate_episodes().
+        """
+        # _WORD_RE tokens never contain '"', so quoting each one is enough to escape it.
+        match = " OR ".join(f'"{w}"' for w in words)
+        uid = str(user_id)
+        try:
             cur = self.conn.cursor()
             cur.execute(
-                "SELECT id, user_id, ts, text, tags, importance FROM episodes WHERE user_id=? ORDER BY ts DESC LIMIT ?",
-                (uid, int(limit)),
+                f"""
+                SELECT e.id, e.user_id, e.ts, e.text, e.tags, e.importance, e.tokens, {_BASE_SCORE_SQL} AS base_score
+                FROM episodes_fts f JOIN episodes e ON e.id = f.rowid
+                WHERE episodes_fts MATCH ? AND e.user_id = ?
+                ORDER BY -bm25(episodes_fts) * 2.0 + base_score DESC
+                LIMIT ?
+                """,
+                (int(now), match, uid, int(limit)),
             )
             rows = cur.fetchall()
-        return [
-            Episode(
-                id=int(row["id"]),
-                user_id=str(row["user_id"]),
-                ts=int(row["ts"]),
-                text=str(row["text"]),
-                tags=str(row["tags"]),
-                importance=float(row["importance"]),
+        except sqlite3.OperationalError:
+            return None
+        return [(float(row["base_score"]), _episode_from_row(row), row["tokens"]) for row in rows]
+
+    def _mark_used(self, episodes: List[Episode], now: int) -> None:
+        """Bump times_used/last_used_ts for every picked episode in one statement."""
+        if not episodes:
+            return
+        ids = [int(ep.id) for ep in episodes]
+        placeholders = ",".join("?" * len(ids))
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"UPDATE episodes SET times_used = times_used + 1, last_used_ts = ? WHERE id IN ({placeholders})",
+                (int(now), *ids),
             )
-            for row in rows
-        ]
+
+    def _episode_tokens(self, ep: Episode, stored: Optional[str] = None) -> frozenset[str]:
+        tokens = self._token_cache.get(ep.id)
+        if tokens is None:
+            # Splitting the stored column is much cheaper than re-running the regex.
+            tokens = frozenset(stored.split()) if stored is not None else _word_set(f"{ep.text} {ep.tags}")
+            self._token_cache[ep.id] = tokens
+            # Evict oldest if cache too large
+            if len(self._token_cache) > _TOKEN_CACHE_MAX_SIZE:
+                del self._token_cache[next(iter(self._token_cache))]
+        return tokens
+
+    def _bump_episodes_version(self, uid: str) -> None:
+        """Invalidate cached retrievals for uid. Call after the write is committed."""
+        with self._lock:
+            self._episodes_version[uid] = self._episodes_version.get(uid, 0) + 1
 
     def retrieve_relevant(self, user_id: int, query: str, limit: int = 6) -> List[Episode]:
         query = (query or "").strip()
         if not query:
             return []
 
-        qwords = set(_norm_words(query))
+        qwords = _word_set(query)
         if not qwords:
             return []
 
-        candidates = self._fetch_candidate_episodes(user_id, limit=160)
         now = now_ts()
-
+        uid = str(user_id)
+        # Read the version before querying: a write landing mid-scan bumps it, so
+        # this result is stored under a key nobody will look up again.
+        with self._lock:
+            cache_key = (uid, self._episodes_version.get(uid, 0), qwords, int(limit))
+            hit = self._retrieval_cache.get(cache_key)
+        if hit is not None and time.monotonic() - hit[0] < _RETRIEVAL_CACHE_TTL:
+            picked = list(hit[1])
+            self._mark_used(picked, now)
+            return picked
+
+        candidates = self._fetch_matching_episodes(user_id, qwords, now, limit=40) if self._fts else None
+        if candidates is None:
+            candidates = self._fetch_candidate_episodes(user_id, now, limit=160)
+
+        # importance/recency come precomputed from SQL; only word overlap needs Python.
         scored: List[Tuple[float, Episode]] = []
-        for ep in candidates:
-            blob = f"{ep.text} {ep.tags}".lower()
-            ewords = set(_norm_words(blob))
-            overlap = len(qwords.intersection(ewords))
+        for base_score, ep, stored_tokens in candidates:
+            overlap = len(qwords.intersection(self._episode_tokens(ep, stored_tokens)))
             if overlap <= 0:
                 continue
+            scored.append(((overlap * 2.0) + base_score, ep))
 
-            age_days = max(0.0, (now - ep.ts) / 86400.0)
-            recency = clamp(1.0 - (age_days / 30.0), 0.0, 1.0)
-
-            score = (overlap * 2.0) + (ep.importance * 1.5) + (recency * 1.0)
-            scored.append((score, ep))
+        picked = [ep for _, ep in heapq.nlargest(int(limit), scored, key=_score_then_ts)]
 
-        scored.sort(key=lambda x: x[0], reverse=True)
-        picked = [ep for _, ep in scored[: int(limit)]]
+        with self._lock:
+            self._retrieval_cache[cache_key] = (time.monotonic(), list(picked))
+            # Evict oldest if cache too large
+            if len(self._retrieval_cache) > _RETRIEVAL_CACHE_MAX_SIZE:
+                self._retrieval_cache.popitem(last=False)
 
         # Track usage so frequently recalled episodes become more salient over time.
-        if picked:
-            with self._lock:
-                cur = self.conn.cursor()
-                for ep in picked:
-                    cur.execute(
-                        "UPDATE episodes SET times_used = times_used + 1, last_used_ts = ? WHERE id = ?",
-                        (now_ts(), int(ep.id)),
-                    )
-                self.conn.commit()
-
+        self._mark_used(picked, now)
         return picked
 
     def retrieve_relevant_vector(
@@ -402,19 +756,18 @@ class SQLiteMemory:
         now = now_ts()
 
         # Fetch recent episodes with embeddings (reduced from 500 to 100)
-        with self._lock:
-            cur = self.conn.cursor()
-            cur.execute(
-                """
-                SELECT id, user_id, ts, text, tags, importance, embedding
-                FROM episodes
-                WHERE user_id = ? AND embedding IS NOT NULL
-                ORDER BY ts DESC
-                LIMIT 100
-                """,
-                (uid,),
-            )
-            rows = cur.fetchall()
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            SELECT id, user_id, ts, text, tags, importance, embedding
+            FROM episodes
+            WHERE user_id = ? AND embedding IS NOT NULL
+            ORDER BY ts DESC
+            LIMIT 100
+            """,
+            (uid,),
+        )
+        rows = cur.fetchall()
 
         if not rows:
             # No embedded episodes, fall back
@@ -460,20 +813,10 @@ class SQLiteMemory:
             )
             scored.append((hybrid, ep))
 
-        scored.sort(key=lambda x: x[0], reverse=True)
-        picked = [ep for _, ep in scored[:limit]]
+        picked = [ep for _, ep in heapq.nlargest(limit, scored, key=_score_then_ts)]
 
         # Track usage
-        if picked:
-            with self._lock:
-                cur = self.conn.cursor()
-                for ep in picked:
-                    cur.execute(
-                        "UPDATE episodes SET times_used = times_used + 1, last_used_ts = ? WHERE id = ?",
-                        (now_ts(), int(ep.id)),
-                    )
-                self.conn.commit()
-
+        self._mark_used(picked, now)
         return picked
 
     def episodes_as_prompt(self, episodes: List[Episode]) -> str:
@@ -491,35 +834,45 @@ class SQLiteMemory:
     # -------------------------
 
     def add_message(self, user_id: int, role: str, content: str, ts: Optional[int] = None) -> None:
+        self.add_messages(user_id, [(role, content, ts)])
+
+    def add_messages(self, user_id: int, messages: Iterable[Tuple[str, str, Optional[int]]]) -> None:
+        """add_message() for several (role, content, ts) rows in one executemany and commit."""
         uid = str(user_id)
-        role = (role or "").strip().lower()
-        content = self.redact((content or "").strip())
-        if role not in {"user", "assistant", "system"}:
-            role = "user"
-        if not content:
+        default_ts = now_ts()
+        rows = []
+        for role, content, ts in messages:
+            role = (role or "").strip().lower()
+            content = self.redact((content or "").strip())
+            if role not in {"user", "assistant", "system"}:
+                role = "user"
+            if content:
+                rows.append((uid, int(ts or default_ts), role, content))
+
+        if not rows:
             return
 
-        ts = int(ts or now_ts())
-        with self._lock:
-            cur = self.conn.cursor()
-            cur.execute(
+        with self._lock, self.conn:
+            self.conn.executemany(
                 "INSERT INTO messages(user_id, ts, role, content) VALUES(?, ?, ?, ?)",
-                (uid, ts, role, content),
+                rows,
             )
-            self.conn.commit()
 
-        self._msg_counter[uid] = self._msg_counter.get(uid, 0) + 1
+        self._msg_counter[uid] = self._msg_counter.get(uid, 0) + len(rows)
+
+        self._messages_since_optimize += len(rows)
+        if self._messages_since_optimize >= _OPTIMIZE_EVERY_N_MESSAGES:
+            self._messages_since_optimize = 0
+            with self._lock:
+                self._optimize()
 
     def get_recent_messages(self, user_id: int, limit: int = 12) -> List[Dict[str, str]]:
         uid = str(user_id)
-        with self._lock:
-            cur = self.conn.cursor()
-            cur.execute(
-                "SELECT role, content FROM messages WHERE user_id=? ORDER BY ts DESC LIMIT ?",
-                (uid, int(limit)),
-            )
-            rows = cur.fetchall()
-            return [{"role": str(r["role"]), "content": str(r["content"])} for r in rows][::-1]
+        rows = self.conn.execute(
+            "SELECT role, content FROM messages WHERE user_id=? ORDER BY ts DESC LIMIT ?",
+            (uid, int(limit)),
+        ).fetchall()
+        return [{"role": str(r["role"]), "content": str(r["content"])} for r in rows][::-1]
 
     # -------------------------
     # LLM extraction (optional)
@@ -533,6 +886,23 @@ class SQLiteMemory:
         self._msg_counter[str(user_id)] = 0
 
     def extract_and_store(self, user_id: int, ask_llama_fn, window: int = 12) -> None:
+        """Ask the LLM for facts/episodes from the recent messages and store them.
+
+        Blocking (LLM call + embedding); run it in a worker thread. Uses that
+        thread's own connection and skips if this user's extraction is already running.
+        """
+        uid = str(user_id)
+        with self._extract_lock:
+            if uid in self._extract_in_flight:
+                return
+            self._extract_in_flight.add(uid)
+        try:
+            self._extract_and_store(user_id, ask_llama_fn, window)
+        finally:
+            with self._extract_lock:
+                self._extract_in_flight.discard(uid)
+
+    def _extract_and_store(self, user_id: int, ask_llama_fn, window: int) -> None:
         messages = self.get_recent_messages(user_id, limit=window)
         if not messages:
             return
@@ -565,6 +935,7 @@ class SQLiteMemory:
             return
 
         facts = data.get("facts", [])
+        facts_to_store: List[Tuple[str, str, float]] = []
         if isinstance(facts, list):
             for f in facts[:10]:
                 if not isinstance(f, dict):
@@ -579,9 +950,10 @@ class SQLiteMemory:
                     continue
                 if len(key) > 48 or len(val) > 240:
                     continue
-                self.upsert_fact(user_id, key, val, confidence=conf)
+                facts_to_store.append((key, val, conf))
 
         eps = data.get("episodes", [])
+        to_add: List[Tuple[str, List[str], float]] = []
         if isinstance(eps, list):
             for e in eps[:3]:
                 if not isinstance(e, dict):
@@ -600,7 +972,36 @@ class SQLiteMemory:
                 except Exception:
                     imp = 0.5
 
-                self.add_episode(user_id, text=text, tags=tags, importance=imp)
+                to_add.append((text, tags, imp))
+
+        # One batch embedding request instead of one per episode (outside the lock).
+        embeddings: List[Optional[List[float]]] = [None] * len(to_add)
+        if to_add:
+            mv = _get_vector_module()
+            if mv:
+                embeddings = mv.embed_texts_batch(
+                    [_episode_embed_text(text, _tags_to_str(tags)) for text, tags, _ in to_add]
+                )
+
+        # All facts + episodes land in one transaction (one commit instead of up to 13),
+        # stamped with one timestamp.
+        if facts_to_store or to_add:
+            now = now_ts()
+            with self._lock:
+                try:
+                    if not self.conn.in_transaction:
+                        self.conn.execute("BEGIN IMMEDIATE")
+                    self.upsert_facts(user_id, facts_to_store, ts=now, commit=False)
+                    self.add_episodes(
+                        user_id,
+                        [(text, tags, imp, emb) for (text, tags, imp), emb in zip(to_add, embeddings)],
+                        ts=now, commit=False,
+                    )
+                    self.conn.commit()
+                    self._bump_episodes_version(str(user_id))
+                except Exception:
+                    self.conn.rollback()
+                    raise
 
         # Keep the DB bounded.
         try:
@@ -645,6 +1046,15 @@ class SQLiteMemory:
 
     def close(self) -> None:
         try:
-            self.conn.close()
+            with self._lock:
+                self._optimize()
         except Exception:
             pass
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._tls = threading.local()
@@ -10,7 +10,11 @@ Requires: numpy (for cosine similarity), requests (already used by ai.py)
 
 from __future__ import annotations
 
+import math
 import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Tuple
 
 import numpy as np
@@ -24,18 +28,40 @@ import requests
 OLLAMA_URL = "http://localhost:11434"
 EMBED_MODEL = "nomic-embed-text"  # Good balance of quality/speed, 768 dimensions
 
+# (connect, read): a dead server fails fast instead of stalling a whole batch.
+_HTTP_TIMEOUT = (3, 10)
+_BATCH_FALLBACK_WORKERS = 8
+
+# One keep-alive session per thread, so repeated embeds skip the TCP handshake.
+# requests.Session is not thread-safe, and embeds run from asyncio.to_thread
+# workers and the batch fallback pool; each thread only needs one connection.
+_SESSION_LOCAL = threading.local()
+
+
+def _session() -> requests.Session:
+    session = getattr(_SESSION_LOCAL, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _SESSION_LOCAL.session = session
+    return session
+
 # Dimension of embeddings (nomic-embed-text = 768)
 # Will be auto-detected on first call
 _EMBED_DIM: Optional[int] = None
 
-# LRU cache for query embeddings (avoids re-embedding same queries)
-_EMBED_CACHE: dict[str, List[float]] = {}
-_CACHE_MAX_SIZE = 100  # Keep last 100 unique queries
+# LRU cache for query embeddings (avoids re-embedding same queries).
+# Insertion order is recency order: hits are moved to the end, the front is evicted.
+_EMBED_CACHE: OrderedDict[str, List[float]] = OrderedDict()
+_CACHE_MAX_SIZE = 512  # Keep last 512 unique queries
+_CACHE_LOCK = threading.Lock()  # embed_text may run on several threads (batch fallback)
 
 
 def _cache_key(text: str, model: str) -> str:
-    """Generate cache key for text+model."""
-    return f"{model}:{text[:200].strip().lower()}"
+    """Generate cache key for text+model (whole normalized text, so long queries don't collide)."""
+    return f"{model}:{text.strip().lower()}"
 
 
 # -------------------------
@@ -58,14 +84,18 @@ def embed_text(text: str, model: str = EMBED_MODEL, use_cache: bool = True) -> O
     # Check cache first
     if use_cache:
         key = _cache_key(text, model)
-        if key in _EMBED_CACHE:
-            return _EMBED_CACHE[key]
+        with _CACHE_LOCK:
+            cached = _EMBED_CACHE.get(key)
+            if cached is not None:
+                _EMBED_CACHE.move_to_end(key)  # mark as most recently used
+        if cached is not None:
+            return cached
     
     try:
-        response = requests.post(
+        response = _session().post(
             f"{OLLAMA_URL}/api/embeddings",
             json={"model": model, "prompt": text},
-            timeout=10,  # Reduced from 30s
+            timeout=_HTTP_TIMEOUT,
         )
         response.raise_for_status()
         data = response.json()
@@ -79,11 +109,11 @@ def embed_text(text: str, model: str = EMBED_MODEL, use_cache: bool = True) -> O
             # Cache the result
             if use_cache:
                 key = _cache_key(text, model)
-                _EMBED_CACHE[key] = embedding
-                # Evict oldest if cache too large
-                if len(_EMBED_CACHE) > _CACHE_MAX_SIZE:
-                    oldest_key = next(iter(_EMBED_CACHE))
-                    del _EMBED_CACHE[oldest_key]
+                with _CACHE_LOCK:
+                    _EMBED_CACHE[key] = embedding
+                    # Evict oldest if cache too large
+                    if len(_EMBED_CACHE) > _CACHE_MAX_SIZE:
+                        _EMBED_CACHE.popitem(last=False)
             
             return embedding
         return None
@@ -97,34 +127,90 @@ def embed_texts_batch(texts: List[str], model: str = EMBED_MODEL) -> List[Option
     """
     Embed multiple texts. Returns list of embeddings (None for failures).
     
-    Note: Ollama doesn't have a true batch endpoint, so this is sequential.
-    Could be parallelized with threads if needed.
+    Uses Ollama's batch endpoint (/api/embed) so N texts cost one request.
+    Older Ollama versions without it fall back to one embed_text() call per text,
+    issued concurrently (the calls are I/O-bound and Ollama serves them in parallel).
     """
-    return [embed_text(t, model) for t in texts]
+    global _EMBED_DIM
+    
+    cleaned = [(t or "").strip() for t in texts]
+    inputs = [t for t in cleaned if t]
+    if not inputs:
+        return [None] * len(cleaned)
+    
+    try:
+        response = _session().post(
+            f"{OLLAMA_URL}/api/embed",
+            json={"model": model, "input": inputs},
+            timeout=_HTTP_TIMEOUT,
+        )
+        response.raise_for_status()
+        embeddings = response.json().get("embeddings")
+        if (
+            isinstance(embeddings, list)
+            and len(embeddings) == len(inputs)
+            and all(e and isinstance(e, list) for e in embeddings)
+        ):
+            if _EMBED_DIM is None:
+                _EMBED_DIM = len(embeddings[0])
+            it = iter(embeddings)
+            return [next(it) if t else None for t in cleaned]
+    except Exception:
+        pass
+    
+    if len(inputs) == 1:
+        return [embed_text(t, model) if t else None for t in cleaned]
+    workers = min(_BATCH_FALLBACK_WORKERS, len(inputs))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda t: embed_text(t, model), cleaned))
 
 
 # -------------------------
 # Serialization (for SQLite BLOB storage)
 # -------------------------
 
+# Quantized layout: magic (4 bytes) + float32 scale + one int8 per dimension.
+# Vectors are L2-normalized before quantizing, so scale * int8 is a unit vector.
+# Legacy blobs are plain float32 arrays; the magic is a float32 of ~2e-38, which
+# never shows up as the first component of a real embedding.
+_Q8_MAGIC = b"Q8\x00\x01"
+_Q8_HEADER = len(_Q8_MAGIC) + 4
+
+
+def is_quantized_blob(blob: bytes) -> bool:
+    """True for int8 blobs written by embedding_to_blob(), False for legacy float32."""
+    return blob[:4] == _Q8_MAGIC
+
+
 def embedding_to_blob(embedding: List[float]) -> bytes:
-    """Pack float list into bytes for SQLite BLOB storage."""
-    return struct.pack(f"{len(embedding)}f", *embedding)
+    """Normalize, quantize to int8 with a per-vector scale and pack for SQLite BLOB storage.
+
+    4x smaller than float32, and unit length means cosine similarity is a plain dot
+    product at query time. Only the direction is kept, which is all retrieval uses.
+    """
+    vec = np.asarray(embedding, dtype=np.float32)
+    vec = vec / (np.linalg.norm(vec) + 1e-12)
+    peak = float(np.abs(vec).max()) if vec.size else 0.0
+    scale = peak / 127.0 if peak > 0 else 1.0
+    quantized = np.round(vec / scale).astype(np.int8)
+    return _Q8_MAGIC + struct.pack("f", scale) + quantized.tobytes()
 
 
 def blob_to_embedding(blob: bytes) -> List[float]:
-    """Unpack bytes back to float list."""
-    count = len(blob) // 4  # 4 bytes per float
-    return list(struct.unpack(f"{count}f", blob))
+    """Unpack bytes back to float list (either storage format)."""
+    return blob_to_numpy(blob).tolist()
 
 
 def embedding_to_numpy(embedding: List[float]) -> np.ndarray:
-    """Convert embedding list to numpy array for math operations."""
-    return np.array(embedding, dtype=np.float32)
+    """Convert embedding list to numpy array for math operations (no copy if already float32)."""
+    return np.asarray(embedding, dtype=np.float32)
 
 
 def blob_to_numpy(blob: bytes) -> np.ndarray:
-    """Convert BLOB directly to numpy array."""
+    """Convert BLOB directly to numpy array (dequantizing int8 blobs)."""
+    if is_quantized_blob(blob):
+        (scale,) = struct.unpack_from("f", blob, 4)
+        return np.frombuffer(blob, dtype=np.int8, offset=_Q8_HEADER).astype(np.float32) * np.float32(scale)
     return np.frombuffer(blob, dtype=np.float32)
 
 
@@ -137,13 +223,66 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     Compute cosine similarity between two vectors.
     Returns value in [-1, 1], higher = more similar.
     """
-    norm_a = np.linalg.norm(a)
-    norm_b = np.linalg.norm(b)
+    # dot(x, x) skips np.linalg.norm's generic dispatch; this is called on single vectors.
+    norm_sq = float(np.dot(a, a)) * float(np.dot(b, b))
     
-    if norm_a == 0 or norm_b == 0:
+    if norm_sq == 0:
         return 0.0
     
-    return float(np.dot(a, b) / (norm_a * norm_b))
+    return float(np.dot(a, b)) / math.sqrt(norm_sq)
+
+
+def cosine_unit(a: np.ndarray, b: np.ndarray) -> float:
+    """Cosine similarity of two vectors already scaled to unit length (e.g. blob_to_numpy output)."""
+    return float(np.dot(a, b))
+
+
+def _q8_similarities(matrix: np.ndarray, query: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """scale * (int8 row . query) per row; loop form for numba (see _get_q8_kernel)."""
+    n, dim = matrix.shape
+    out = np.empty(n, dtype=np.float32)
+    for i in range(n):
+        acc = np.float32(0.0)
+        for j in range(dim):
+            acc += matrix[i, j] * query[j]
+        out[i] = acc * scales[i]
+    return out
+
+
+# Compiled kernel once ready; None while compiling (or if numba is missing).
+_q8_kernel = None
+_q8_warmup_started = False
+_q8_warmup_lock = threading.Lock()
+
+
+def _warm_q8_kernel() -> None:
+    """JIT-compile the int8 kernel and run it once on a tiny input (background thread)."""
+    global _q8_kernel
+    try:
+        import numba
+
+        kernel = numba.njit(cache=True, fastmath=True)(_q8_similarities)
+        kernel(np.zeros((1, 2), dtype=np.int8), np.zeros(2, dtype=np.float32), np.ones(1, dtype=np.float32))
+    except Exception:
+        return  # numba missing or unusable: stay on the numpy path
+    _q8_kernel = kernel
+
+
+def _get_q8_kernel():
+    """Return the compiled int8 similarity kernel, or None until it is ready.
+
+    Fusing the int8 -> float widening into the dot product skips the float32 copy
+    of the whole candidate matrix that the numpy path needs. The first call starts
+    the ~0.7s compile on a background thread instead of stalling the caller (the
+    event loop, in the bot); callers use the numpy path whenever this returns None.
+    """
+    global _q8_warmup_started
+    if _q8_kernel is None and not _q8_warmup_started:
+        with _q8_warmup_lock:
+            if not _q8_warmup_started:
+                _q8_warmup_started = True
+                threading.Thread(target=_warm_q8_kernel, name="q8-kernel-warmup", daemon=True).start()
+    return _q8_kernel
 
 
 def find_similar(
@@ -164,7 +303,7 @@ def find_similar(
     Returns:
         List of (id, similarity_score) tuples, sorted by score descending
     """
-    if not query_embedding or not candidates:
+    if not query_embedding or not candidates or top_k <= 0:
         return []
     
     query_vec = embedding_to_numpy(query_embedding)
@@ -175,34 +314,55 @@ def find_similar(
     # Pre-normalize query once
     query_normalized = query_vec / query_norm
     
-    # Batch process all candidates for vectorized similarity
+    # Group blobs by storage format; only the query's dimension can share a matrix.
+    dim = query_vec.size
     ids = []
-    embeddings = []
+    q8_rows = []
+    q8_blobs = []
+    f32_rows = []
+    f32_blobs = []
     for item_id, blob in candidates:
-        if blob:
-            try:
-                embeddings.append(blob_to_numpy(blob))
-                ids.append(item_id)
-            except Exception:
-                continue
-    
-    if not embeddings:
-        return []
+        if not blob:
+            continue
+        if len(blob) == _Q8_HEADER + dim and is_quantized_blob(blob):
+            q8_rows.append(len(ids))
+            q8_blobs.append(blob)
+        elif len(blob) == 4 * dim:
+            f32_rows.append(len(ids))
+            f32_blobs.append(blob)
+        else:
+            continue
+        ids.append(item_id)
     
-    # Stack into matrix and compute all similarities at once
-    matrix = np.vstack(embeddings)  # Shape: (n_candidates, dim)
-    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
-    norms[norms == 0] = 1  # Avoid division by zero
-    matrix_normalized = matrix / norms
+    if not ids:
+        return []
     
-    # Vectorized dot product
-    similarities = matrix_normalized @ query_normalized  # Shape: (n_candidates,)
+    similarities = np.empty(len(ids), dtype=np.float32)
+    # One buffer -> (n_candidates, dim) matrix per format, no per-row array objects
+    if q8_rows:
+        # Stored vectors are unit length: cosine = scale * (int8 row . query), no norms.
+        raw = np.frombuffer(b"".join(q8_blobs), dtype=np.uint8).reshape(len(q8_blobs), _Q8_HEADER + dim)
+        scales = raw[:, 4:_Q8_HEADER].copy().view(np.float32).ravel()
+        matrix = raw[:, _Q8_HEADER:].view(np.int8)
+        kernel = _get_q8_kernel()
+        if kernel is not None:
+            similarities[q8_rows] = kernel(matrix, query_normalized, scales)
+        else:
+            similarities[q8_rows] = (matrix.astype(np.float32) @ query_normalized) * scales
+    if f32_rows:
+        # Legacy float32 rows were stored as-is, so they still need their norms.
+        matrix = np.frombuffer(b"".join(f32_blobs), dtype=np.float32).reshape(len(f32_blobs), dim)
+        norms = np.linalg.norm(matrix, axis=1)
+        norms[norms == 0] = 1  # Avoid division by zero
+        similarities[f32_rows] = (matrix @ query_normalized) / norms
     
-    # Filter and sort
-    scored = [(ids[i], float(similarities[i])) for i in range(len(ids)) if similarities[i] >= threshold]
-    scored.sort(key=lambda x: x[1], reverse=True)
+    # Filter, then partial top-k selection instead of a full sort
+    keep = np.flatnonzero(similarities >= threshold)
+    if keep.size > top_k:
+        keep = keep[np.argpartition(similarities[keep], -top_k)[-top_k:]]
+    keep = keep[np.argsort(-similarities[keep], kind="stable")]
     
-    return scored[:top_k]
+    return [(ids[i], float(similarities[i])) for i in keep]
 
 
 # -------------------------
@@ -212,8 +372,9 @@ def find_similar(
 def clear_embed_cache() -> int:
     """Clear the embedding cache. Returns number of entries cleared."""
     global _EMBED_CACHE
-    count = len(_EMBED_CACHE)
-    _EMBED_CACHE.clear()
+    with _CACHE_LOCK:
+        count = len(_EMBED_CACHE)
+        _EMBED_CACHE.clear()
     return count
 
 
@@ -4,9 +4,15 @@ Priority queue system for Discord messages.
 
 Features:
 - Priority levels: CRITICAL > HIGH > NORMAL > LOW
-- Single worker prevents Ollama overload
+- Small worker pool (default 1) with a cap on concurrent handler calls,
+  so Ollama is never overloaded; one user's messages are handled in order
 - Integrates with burst buffer (sits after it)
+- Messages a user sent while waiting in the queue are merged into one request
+  (per priority level, so a LOW backlog never rides along with a HIGH message)
 - Trust-based priority boost for trusted users
+- When full, higher-priority messages shed the newest LOWest-priority one;
+  others wait up to `admit_timeout` for space before being dropped
+- Aging: waiting messages gain one priority level per `aging_s`, so LOW is never starved
 
 Usage:
     from message_queue import message_queue, Priority
@@ -21,7 +27,8 @@ Usage:
 from __future__ import annotations
 
 import asyncio
-from dataclasses import dataclass, field
+import heapq
+from dataclasses import dataclass
 from enum import IntEnum
 from typing import Callable, Awaitable, Optional, TYPE_CHECKING
 from time import time
@@ -38,30 +45,55 @@ class Priority(IntEnum):
     LOW = 3       # Background tasks, random engagement
 
 
-@dataclass(order=True)
+@dataclass
 class QueueItem:
-    """A queued message with priority ordering."""
+    """A queued message. Ordering lives in the heap entry, not here."""
     priority: int
-    timestamp: float = field(compare=True)
-    message: "discord.Message" = field(compare=False)
-    user_text: str = field(compare=False)
-    raw_content: str = field(compare=False, default="")
+    timestamp: float
+    message: "discord.Message"
+    user_text: str
+    raw_content: str = ""
 
 
 class MessageQueue:
     """
-    Priority queue for Discord messages with a single worker.
+    Priority queue for Discord messages with a pool of workers.
     
-    Messages are processed one at a time in priority order.
-    This prevents Ollama from being overwhelmed by concurrent requests.
+    Messages are taken in priority order by `n_workers` workers; at most
+    `handler_concurrency` handler calls run at once (defaults to n_workers),
+    which bounds concurrent Ollama requests. Messages from the same user in
+    the same channel are still handled one at a time, in queue order.
     """
     
-    def __init__(self, max_size: int = 100):
-        self._queue: asyncio.PriorityQueue[QueueItem] = asyncio.PriorityQueue(maxsize=max_size)
+    def __init__(
+        self,
+        max_size: int = 100,
+        n_workers: int = 1,
+        handler_concurrency: Optional[int] = None,
+        coalesce_max: int = 6,
+        aging_s: float = 30.0,
+    ):
+        # Heap of (priority, seq, item): seq keeps FIFO order within a priority and
+        # means items are never compared. Idle workers wait on the Event.
+        self._heap: list[tuple[int, int, QueueItem]] = []
+        self._seq = 0
+        self._max_size = max_size
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
         self._handler: Optional[Callable[["discord.Message", str, str], Awaitable[None]]] = None
-        self._worker_task: Optional[asyncio.Task] = None
+        self._n_workers = max(1, n_workers)
+        self._handler_slots = asyncio.Semaphore(max(1, handler_concurrency or self._n_workers))
+        # Conversations with a handler call in flight, keyed by (channel_id, user_id)
+        # like the burst buffer; their queued messages stay put until it finishes
+        self._busy: set[tuple[int, int]] = set()
+        self._worker_tasks: list[asyncio.Task] = []
+        # Max queued messages from one conversation merged into a single handler call
+        self._coalesce_max = max(1, coalesce_max)
+        # Heap keys are re-aged at most once per aging_s (<= 0 disables aging)
+        self._aging_s = aging_s
+        self._last_aged = time()
         self._running = False
-        self._processing = False
+        self._active = 0
         
         # Stats
         self.processed_count = 0
@@ -73,11 +105,14 @@ class MessageQueue:
         user_text: str,
         priority: Priority = Priority.NORMAL,
         raw_content: str = "",
+        admit_timeout: float = 0.1,
     ) -> bool:
         """
         Add a message to the queue.
         
-        Returns True if queued, False if queue is full.
+        If the queue is full, a lower-priority queued message is shed to make
+        room; failing that, waits up to `admit_timeout` seconds for a worker to
+        free a slot. Returns True if queued, False if dropped.
         """
         item = QueueItem(
             priority=priority.value,
@@ -87,12 +122,25 @@ class MessageQueue:
             raw_content=raw_content,
         )
         
-        try:
-            self._queue.put_nowait(item)
-            return True
-        except asyncio.QueueFull:
-            self.dropped_count += 1
-            return False
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + admit_timeout
+        while self._max_size > 0 and len(self._heap) >= self._max_size:
+            if self._shed_below(item.priority):
+                break
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self.dropped_count += 1
+                return False
+            self._not_full.clear()
+            try:
+                await asyncio.wait_for(self._not_full.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+        
+        heapq.heappush(self._heap, (item.priority, self._seq, item))
+        self._seq += 1
+        self._not_empty.set()
+        return True
     
     async def enqueue_with_trust(
         self,
@@ -100,6 +148,7 @@ class MessageQueue:
         user_text: str,
         trust_score: float = 0.0,
         raw_content: str = "",
+        admit_timeout: float = 0.1,
     ) -> bool:
         """
         Queue with automatic priority based on trust score.
@@ -115,7 +164,7 @@ class MessageQueue:
         else:
             priority = Priority.LOW
         
-        return await self.enqueue(message, user_text, priority, raw_content)
+        return await self.enqueue(message, user_text, priority, raw_content, admit_timeout)
     
     def set_handler(
         self,
@@ -128,7 +177,7 @@ class MessageQueue:
         self,
         handler: Optional[Callable[["discord.Message", str, str], Awaitable[None]]] = None,
     ) -> None:
-        """Start the queue worker. Call this once in on_ready."""
+        """Start the queue workers. Call this once in on_ready."""
         if handler:
             self._handler = handler
         
@@ -139,52 +188,164 @@ class MessageQueue:
             return
         
         self._running = True
-        self._worker_task = asyncio.create_task(self._worker_loop())
+        self._worker_tasks = [
+            asyncio.create_task(self._worker_loop()) for _ in range(self._n_workers)
+        ]
     
     async def stop_worker(self) -> None:
-        """Stop the queue worker gracefully."""
+        """Stop the queue workers gracefully."""
         self._running = False
-        if self._worker_task:
-            self._worker_task.cancel()
-            try:
-                await self._worker_task
-            except asyncio.CancelledError:
-                pass
+        tasks, self._worker_tasks = self._worker_tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
     
     async def _worker_loop(self) -> None:
-        """Main worker loop - processes messages one at a time."""
+        """Worker loop - each worker processes one message at a time."""
         while self._running:
-            try:
-                # Wait for next item (blocks until available)
-                item = await asyncio.wait_for(
-                    self._queue.get(),
-                    timeout=1.0,  # Check running flag periodically
-                )
-            except asyncio.TimeoutError:
+            if not self._heap:
+                # Sleep until enqueue() signals; stop_worker() cancels this wait.
+                self._not_empty.clear()
+                try:
+                    await self._not_empty.wait()
+                except asyncio.CancelledError:
+                    break
+                continue
+            
+            self._age()
+            entry = self._pop_ready()
+            if entry is None:
+                # Everything queued belongs to a busy conversation; its worker
+                # sets the Event when it finishes.
+                self._not_empty.clear()
+                try:
+                    await self._not_empty.wait()
+                except asyncio.CancelledError:
+                    break
                 continue
-            except asyncio.CancelledError:
-                break
             
+            _, seq, item = entry
+            self._not_full.set()
+            # Claimed before the next await, so no other worker can take this
+            # user's later messages; they stay queued for _coalesce.
+            key = self._conversation_key(item)
+            self._busy.add(key)
             try:
-                self._processing = True
-                await self._handler(item.message, item.user_text, item.raw_content)
+                async with self._handler_slots:
+                    item = self._coalesce(item, seq, key)
+                    self._active += 1
+                    try:
+                        await self._handler(item.message, item.user_text, item.raw_content)
+                    finally:
+                        self._active -= 1
                 self.processed_count += 1
             except Exception as e:
                 # Log but don't crash the worker
                 print(f"[Queue] Handler error: {e}")
             finally:
-                self._processing = False
-                self._queue.task_done()
+                self._busy.discard(key)
+                if self._heap:
+                    self._not_empty.set()
+    
+    @staticmethod
+    def _conversation_key(item: QueueItem) -> tuple[int, int]:
+        return (item.message.channel.id, item.message.author.id)
+    
+    def _pop_ready(self) -> Optional[tuple[int, int, QueueItem]]:
+        """Pop the best entry whose conversation is not busy; None if there is none."""
+        skipped = []
+        entry = None
+        while self._heap:
+            candidate = heapq.heappop(self._heap)
+            if self._conversation_key(candidate[2]) in self._busy:
+                skipped.append(candidate)
+                continue
+            entry = candidate
+            break
+        for e in skipped:
+            heapq.heappush(self._heap, e)
+        return entry
+    
+    def _shed_below(self, priority: int) -> bool:
+        """Drop the newest queued message with a lower priority than `priority`, if any."""
+        victim = max(
+            (e for e in self._heap if e[2].priority > priority),
+            key=lambda e: (e[2].priority, e[1]),
+            default=None,
+        )
+        if victim is None:
+            return False
+        self._heap.remove(victim)
+        heapq.heapify(self._heap)
+        self.dropped_count += 1
+        author = getattr(victim[2].message.author, "display_name", victim[2].message.author.id)
+        print(f"[Queue] Shed priority {victim[2].priority} message from {author} (queue full)")
+        return True
+    
+    def _age(self) -> None:
+        """
+        Promote messages by one priority level per `aging_s` spent waiting.
+        
+        Rebuilds the heap at most once per `aging_s` (O(n) on a small queue),
+        so sustained HIGH traffic can delay a LOW message by roughly
+        3 * aging_s at most instead of forever. Ties still go by arrival order.
+        """
+        if self._aging_s <= 0:
+            return
+        now = time()
+        if now - self._last_aged < self._aging_s:
+            return
+        self._last_aged = now
+        
+        self._heap = [
+            (min(key, max(0, item.priority - int((now - item.timestamp) // self._aging_s))), seq, item)
+            for key, seq, item in self._heap
+        ]
+        heapq.heapify(self._heap)
+    
+    def _coalesce(self, item: QueueItem, seq: int, key: tuple[int, int]) -> QueueItem:
+        """
+        Merge the conversation's other queued messages of the same priority into `item`.
+        
+        Like the burst buffer, the texts are joined with newlines and the last
+        message is the one replied to, so a user who kept typing while the bot
+        was busy gets one answer instead of one per message.
+        """
+        if self._coalesce_max <= 1:
+            return item
+        
+        same = sorted(  # arrival order
+            (
+                e for e in self._heap
+                if e[2].priority == item.priority and self._conversation_key(e[2]) == key
+            ),
+            key=lambda e: e[1],
+        )[: self._coalesce_max - 1]
+        if not same:
+            return item
+        
+        taken = {e[1] for e in same}
+        self._heap = [e for e in self._heap if e[1] not in taken]
+        heapq.heapify(self._heap)
+        self._not_full.set()
+        parts = [e[2] for e in sorted(same + [(item.priority, seq, item)], key=lambda e: e[1])]
+        return QueueItem(
+            priority=item.priority,
+            timestamp=parts[0].timestamp,
+            message=parts[-1].message,
+            user_text="\n".join(p.user_text for p in parts if p.user_text),
+            raw_content="\n".join(p.raw_content for p in parts if p.raw_content),
+        )
     
     @property
     def size(self) -> int:
         """Current queue size."""
-        return self._queue.qsize()
+        return len(self._heap)
     
     @property
     def is_processing(self) -> bool:
-        """Whether the worker is currently processing a message."""
-        return self._processing
+        """Whether any worker is currently processing a message."""
+        return self._active > 0
     
     @property
     def is_running(self) -> bool:
@@ -197,7 +358,8 @@ class MessageQueue:
             "queued": self.size,
             "processed": self.processed_count,
             "dropped": self.dropped_count,
-            "is_processing": self._processing,
+            "is_processing": self._active > 0,
+            "workers": self._n_workers,
             "is_running": self._running,
         }
 
@@ -42,6 +42,9 @@ def migrate():
 
     conn = sqlite3.connect(str(DB_PATH))
     conn.row_factory = sqlite3.Row
+    # Same journaling as the bot's connections; commits skip the per-commit fsync.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
 
     # Count episodes needing embedding
     cur = conn.cursor()
@@ -59,41 +62,49 @@ def migrate():
 
     processed = 0
     failed = 0
+    last_id = 0
     start_time = time.time()
 
     while True:
-        # Fetch batch of episodes without embeddings
+        # Fetch next batch of episodes without embeddings. Walking the rowid past
+        # the previous batch scans the table once overall, and rows that failed
+        # to embed are not fetched again.
         cur.execute(
             """
             SELECT id, text, tags
             FROM episodes
-            WHERE embedding IS NULL
+            WHERE embedding IS NULL AND id > ?
+            ORDER BY id
             LIMIT ?
             """,
-            (BATCH_SIZE,),
+            (last_id, BATCH_SIZE),
         )
         rows = cur.fetchall()
 
         if not rows:
             break
+        last_id = rows[-1]["id"]
 
-        for row in rows:
-            ep_id = row["id"]
-            text = f"{row['text']} {row['tags']}".strip()
+        # One /api/embed request per batch instead of one round trip per episode;
+        # episodes with identical text + tags share one embedding.
+        texts = [f"{row['text']} {row['tags']}".strip() for row in rows]
+        unique = list(dict.fromkeys(texts))
+        by_text = dict(zip(unique, mv.embed_texts_batch(unique)))
+        embeddings = [by_text[t] for t in texts]
 
-            embedding = mv.embed_text(text)
+        updates = []
+        for row, embedding in zip(rows, embeddings):
+            ep_id = row["id"]
             if embedding:
-                blob = mv.embedding_to_blob(embedding)
-                cur.execute(
-                    "UPDATE episodes SET embedding = ? WHERE id = ?",
-                    (blob, ep_id),
-                )
-                processed += 1
+                updates.append((mv.embedding_to_blob(embedding), ep_id))
             else:
                 failed += 1
                 print(f"  Failed to embed episode {ep_id}")
 
-        conn.commit()
+        # One statement and one transaction per batch
+        with conn:
+            conn.executemany("UPDATE episodes SET embedding = ? WHERE id = ?", updates)
+        processed += len(updates)
 
         # Progress update
         elapsed = time.time() - start_time
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import re
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from memory_sqlite import SQLiteMemory
 
@@ -144,6 +145,13 @@ class Long_Term_Memory:
             "voice_enabled": False,
         }
 
+        # What is on disk, recorded by the loaders so an unchanged user isn't rewritten
+        # (None when that store could not be read, so it never counts as up to date).
+        self._sqlite_facts: Optional[Dict[str, str]] = None
+        self._json_on_disk: Optional[Dict[str, Any]] = None
+        # Last snapshot written (or confirmed on disk); save() is a no-op while it matches.
+        self._saved: Optional[Dict[str, Any]] = None
+
         # Load best-effort from SQLite (preferred), then JSON snapshot as fallback.
         self._load_from_sqlite(int(user_id))
         self.load()
@@ -152,7 +160,15 @@ class Long_Term_Memory:
         if "voice_enabled" not in self.data:
             self.data["voice_enabled"] = False
 
-        # Persist a normalized snapshot
+        # Persist a normalized snapshot, unless both stores already hold it
+        # (the common case when a user is first seen after a restart).
+        snap = self._snapshot()
+        if (
+            self._json_on_disk == snap
+            and self._sqlite_facts is not None
+            and all(self._sqlite_facts.get(key) == value for key, value, _ in self._fact_rows(snap))
+        ):
+            self._saved = snap
         self.save()
 
     # ------------------
@@ -165,6 +181,7 @@ class Long_Term_Memory:
         except Exception:
             return
 
+        self._sqlite_facts = facts or {}
         if not facts:
             return
 
@@ -185,6 +202,7 @@ class Long_Term_Memory:
             try:
                 loaded = json.loads(self.file_path.read_text(encoding="utf-8"))
                 if isinstance(loaded, dict):
+                    self._json_on_disk = loaded
                     # Only accept known keys to prevent prompt injection via JSON file edits.
                     for k in ["name", "preferred_language", "likes", "dislikes", "voice_enabled"]:
                         if k in loaded:
@@ -200,47 +218,67 @@ class Long_Term_Memory:
         if not self.data.get("preferred_language"):
             self.data["preferred_language"] = "English"
 
+    def _snapshot(self) -> Dict[str, Any]:
+        """Normalized copy of .data as written to the JSON snapshot."""
+        return {
+            "name": self.data.get("name"),
+            "preferred_language": self.data.get("preferred_language", "English"),
+            "likes": _list_from_any(self.data.get("likes")),
+            "dislikes": _list_from_any(self.data.get("dislikes")),
+            "voice_enabled": _bool_from_any(self.data.get("voice_enabled", False)),
+        }
+
+    @staticmethod
+    def _fact_rows(snap: Dict[str, Any]) -> List[Tuple[str, str, float]]:
+        """(key, value, confidence) rows mirrored into SQLite facts, from a _snapshot()."""
+        rows = []
+        if snap["name"]:
+            rows.append(("name", str(snap["name"]).strip(), 0.9))
+        if snap["preferred_language"]:
+            rows.append(("preferred_language", str(snap["preferred_language"]).strip(), 0.9))
+        if snap["likes"]:
+            rows.append(("likes", ", ".join(snap["likes"]), 0.7))
+        if snap["dislikes"]:
+            rows.append(("dislikes", ", ".join(snap["dislikes"]), 0.7))
+        rows.append(("voice_enabled", "1" if snap["voice_enabled"] else "0", 1.0))
+        return rows
+
     def save(self) -> None:
-        """Persist to SQLite (structured) and write a JSON snapshot."""
+        """Persist to SQLite (structured) and write a JSON snapshot.
+
+        Skipped when nothing changed since the last save, so callers (and
+        __init__) can call it unconditionally.
+        """
+        snap = self._snapshot()
+        if snap == self._saved:
+            return
+
         try:
             uid = int(self.user_id)
         except Exception:
             uid = 0
 
-        # SQLite facts (structured)
+        # SQLite facts (structured), written in one executemany + commit
+        sqlite_ok = True
         try:
             if uid:
-                if self.data.get("name"):
-                    _SQL.upsert_fact(uid, "name", str(self.data["name"]).strip(), confidence=0.9)
-                if self.data.get("preferred_language"):
-                    _SQL.upsert_fact(uid, "preferred_language", str(self.data["preferred_language"]).strip(), confidence=0.9)
-
-                likes = ", ".join(_list_from_any(self.data.get("likes")))
-                dislikes = ", ".join(_list_from_any(self.data.get("dislikes")))
-
-                if likes:
-                    _SQL.upsert_fact(uid, "likes", likes, confidence=0.7)
-                if dislikes:
-                    _SQL.upsert_fact(uid, "dislikes", dislikes, confidence=0.7)
-
-                _SQL.upsert_fact(uid, "voice_enabled", "1" if _bool_from_any(self.data.get("voice_enabled")) else "0", confidence=1.0)
+                _SQL.upsert_facts(uid, self._fact_rows(snap))
         except Exception as e:
+            sqlite_ok = False
             print(f"[Memory] SQLite save failed for {self.user_id}: {e}")
 
-        # JSON snapshot (debug/compat)
+        # JSON snapshot (debug/compat). Written beside the target and renamed over
+        # it, so a crash mid-write never leaves a truncated file behind.
         try:
-            snap = {
-                "name": self.data.get("name"),
-                "preferred_language": self.data.get("preferred_language", "English"),
-                "likes": _list_from_any(self.data.get("likes")),
-                "dislikes": _list_from_any(self.data.get("dislikes")),
-                "voice_enabled": _bool_from_any(self.data.get("voice_enabled", False)),
-            }
-
-            self.file_path.write_text(
+            tmp_path = self.file_path.with_name(self.file_path.name + ".tmp")
+            tmp_path.write_text(
                 json.dumps(snap, indent=2, ensure_ascii=False),
                 encoding="utf-8",
             )
+            tmp_path.replace(self.file_path)
+            # Only skip future saves once both stores hold this snapshot.
+            if sqlite_ok:
+                self._saved = snap
         except Exception as e:
             print(f"[Memory] Failed to save {self.user_id}: {e}")
 
@@ -255,19 +293,39 @@ class Long_Term_Memory:
         except Exception:
             pass
 
-    def maybe_extract(self, ask_llama_fn) -> None:
-        """Run LLM memory extraction every N messages (non-blocking caller recommended)."""
+    def maybe_extract(self, ask_llama_fn) -> bool:
+        """Run LLM memory extraction every N messages. Blocking; returns True if it ran.
+
+        Only touches SQLite, never .data or the JSON snapshot, so it is safe on a
+        worker thread; use extract_in_background() from the event loop.
+        """
         try:
             uid = int(self.user_id)
         except Exception:
-            return
+            return False
         try:
             if not _SQL.should_extract(uid, every_n_messages=8):
-                return
+                return False
             _SQL.extract_and_store(uid, ask_llama_fn, window=12)
             _SQL.reset_extract_counter(uid)
+        except Exception:
+            return False
+        return True
+
+    async def extract_in_background(self, ask_llama_fn) -> None:
+        """maybe_extract() on a worker thread, then pick up the new facts on the loop.
+
+        Extraction may rewrite facts this (cached) instance holds; reloading them
+        here keeps a later save() from writing the old values back. The reload and
+        save stay on the event loop, which is the only thread that touches .data.
+        """
+        if not await asyncio.to_thread(self.maybe_extract, ask_llama_fn):
+            return
+        try:
+            self._load_from_sqlite(int(self.user_id))
         except Exception:
             return
+        self.save()
 
     # ------------------
     # Extraction logic (fast, deterministic)
@@ -284,15 +342,8 @@ class Long_Term_Memory:
             self.save()
 
     def _extract_name(self, text: str) -> bool:
-        patterns = [
-            r"\bmy name is ([A-Za-z'-]+)\b",
-            r"\bi am ([A-Za-z'-]+)\b",
-            r"\bi'm ([A-Za-z'-]+)\b",
-            r"\bcall me ([A-Za-z'-]+)\b",
-        ]
-
-        for p in patterns:
-            m = re.search(p, text, re.IGNORECASE)
+        for p in _NAME_PATTERNS:
+            m = p.search(text)
             if m:
                 name = m.group(1)
                 if self.data.get("name") != name:
@@ -301,11 +352,9 @@ class Long_Term_Memory:
         return False
 
     def _extract_language(self, text: str) -> bool:
-        t = text.lower()
-        if "english" in t:
-            return self._set("preferred_language", "English")
-        if "danish" in t:
-            return self._set("preferred_language", "Danish")
+        for pattern, language in _LANGUAGE_PATTERNS:
+            if pattern.search(text):
+                return self._set("preferred_language", language)
         return False
 
     def _extract_likes(self, text: str) -> bool:
@@ -323,19 +372,9 @@ class Long_Term_Memory:
 
         # Detect common preference statements (present tense), allowing up to 3 filler words
         # between "I" and the preference verb (e.g., "I really fucking love coffee").
-        patterns = [
-            r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?like\s+(?P<val>.+)$",
-            r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?love\s+(?P<val>.+)$",
-            r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?enjoy\s+(?P<val>.+)$",
-            r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?prefer\s+(?P<val>.+)$",
-            r"\bi(?:'|\s+a)m\s+into\s+(?P<val>.+)$",
-            r"\bi\s+am\s+into\s+(?P<val>.+)$",
-            r"\bmy\s+favou?rite\b[^\n]{0,32}\b(?:is|are)\s+(?P<val>.+)$",
-        ]
-
         m = None
-        for p in patterns:
-            m = re.search(p, t, re.IGNORECASE)
+        for p in _LIKE_PATTERNS:
+            m = p.search(t)
             if m:
                 break
         if not m:
@@ -343,7 +382,7 @@ class Long_Term_Memory:
 
         # If the user said something like "I don't really like X", don't store it as a like.
         pre = (m.groupdict().get("pre") or "").lower()
-        if re.search(r"\b(don't|do\s+not|didn't|did\s+not|can't|cannot|not|never)\b", pre):
+        if _LIKE_NEGATION_RE.search(pre):
             return False
 
         value = (m.group("val") or "").strip().strip(" .!?:;\n\t").lower()
@@ -355,7 +394,7 @@ class Long_Term_Memory:
             return False
 
         # Reject values that start with a connective + a preference verb (usually indicates meta phrasing)
-        if re.match(r"^(and|or)\s+(hate|hated|dislike|disliked|love|loved|like|liked|enjoy|enjoyed|prefer|preferred)\b", value):
+        if _CONNECTIVE_VERB_PREFIX_RE.match(value):
             return False
 
         # Reject vague values unless the user signals durable intent, then resolve from context.
@@ -370,7 +409,7 @@ class Long_Term_Memory:
         # Avoid saving very session-specific likes unless the user explicitly says it's durable.
         # Example: "I like this answer" is usually feedback, not a stable preference.
         if not self._has_durable_intent(tl):
-            if re.search(r"\b(this|that)\s+(answer|response|message|idea|suggestion|one)\b", value, re.IGNORECASE):
+            if _SESSION_ITEM_RE.search(value):
                 return False
         # Store only one word (keyword) for long-term memory
         value = _first_meaningful_word(value)
@@ -380,7 +419,8 @@ class Long_Term_Memory:
         # Avoid storing junk / ultra-short values
         if len(value) < 2:
             return False
-        likes = _list_from_any(self.data.get("likes"))
+        # Already a normalized list (load() does that once); copy before appending.
+        likes = list(self.data.get("likes") or [])
         if value and value not in likes:
             likes.append(value)
             self.data["likes"] = likes
@@ -401,17 +441,12 @@ class Long_Term_Memory:
         # - "I dislike X"
         # - "I can't stand X"
         # - "I don't like X" / "I do not like X"
-        patterns = [
-            r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?(?:dislike|disliked|hate|hated|can't\s+stand|cannot\s+stand)\s+(?P<val>.+)$",
-            r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?(?:don't|do\s+not|can't|cannot)\s+(?P<mid>(?:[\w']+\s+){0,3})?like\s+(?P<val>.+)$",
-        ]
-
         m = None
         used_pattern = None
-        for p in patterns:
-            m = re.search(p, t, re.IGNORECASE)
+        for i, p in enumerate(_DISLIKE_PATTERNS):
+            m = p.search(t)
             if m:
-                used_pattern = p
+                used_pattern = i
                 break
         if not m:
             return False
@@ -420,7 +455,7 @@ class Long_Term_Memory:
         mid = (m.groupdict().get("mid") or "").lower()
 
         # If it's of the form "I don't hate X" / "I never hated X", ignore.
-        if used_pattern == patterns[0] and re.search(r"\b(don't|do\s+not|not|never)\b", pre):
+        if used_pattern == 0 and _DISLIKE_NEGATION_RE.search(pre):
             return False
 
         # For the "don't like" pattern, ensure it's actually negative (it is by construction),
@@ -449,7 +484,7 @@ class Long_Term_Memory:
         # Avoid storing junk / ultra-short values
         if len(value) < 2:
             return False
-        dislikes = _list_from_any(self.data.get("dislikes"))
+        dislikes = list(self.data.get("dislikes") or [])
         if value and value not in dislikes:
             dislikes.append(value)
             self.data["dislikes"] = dislikes
@@ -468,7 +503,7 @@ class Long_Term_Memory:
         if _ONE_OFF_FEEDBACK_RE.search(tl):
             return True
         # Generic praise without an object ("that was great") is not a stable preference
-        if re.search(r"\bthat\s+(was|is)\s+(nice|good|great|cool|awesome|amazing)\b", tl):
+        if _GENERIC_PRAISE_RE.search(tl):
             return True
         return False
 
@@ -556,14 +591,31 @@ class Long_Term_Memory:
             # Be very explicit to avoid confusion with the bot's own name
             parts.append(f"IMPORTANT: The person you are talking to wants to be called \"{self.data['name']}\" (not your name - YOUR name is mAIcé, THEIR name is {self.data['name']}).")
         parts.append(f"Preferred language: {self.data.get('preferred_language', 'English')}.")
-        likes = _list_from_any(self.data.get("likes"))
-        dislikes = _list_from_any(self.data.get("dislikes"))
+        likes = self.data.get("likes") or []
+        dislikes = self.data.get("dislikes") or []
         if likes:
             parts.append("The user likes: " + ", ".join(likes) + ".")
         if dislikes:
             parts.append("The user dislikes: " + ", ".join(dislikes) + ".")
         return " ".join(parts).strip()
 
+# One instance per user, reused across messages so the hot path skips the
+# SQLite + JSON reload. Instances persist their own changes (see save()).
+_LONG_MEMORY_CACHE_MAX_SIZE = 1024
+long_memories: Dict[str, Long_Term_Memory] = {}
+
+
+def get_long_term_memory(user_id: int) -> Long_Term_Memory:
+    key = str(user_id)
+    lm = long_memories.get(key)
+    if lm is None:
+        lm = long_memories[key] = Long_Term_Memory(user_id)
+        # Evict oldest if cache too large
+        if len(long_memories) > _LONG_MEMORY_CACHE_MAX_SIZE:
+            del long_memories[next(iter(long_memories))]
+    return lm
+
+
 # Meta questions about preferences (not actual stated preferences), e.g.:
 # "Would you like to know what I love and hate?"
 _META_PREFERENCE_QUESTION_RE = re.compile(
@@ -599,3 +651,55 @@ _ONE_OFF_FEEDBACK_RE = re.compile(
     r"\b(that|this|it)\s+(was|is)\s+(nice|good|great|cool|awesome|amazing)\b",
     re.IGNORECASE,
 )
+
+# Preference/identity statements, compiled once. Each list is tried in order and the
+# first pattern that matches anywhere wins, so they are not merged into one alternation.
+_NAME_PATTERNS = tuple(
+    re.compile(p, re.IGNORECASE)
+    for p in (
+        r"\bmy name is ([A-Za-z'-]+)\b",
+        r"\bi am ([A-Za-z'-]+)\b",
+        r"\bi'm ([A-Za-z'-]+)\b",
+        r"\bcall me ([A-Za-z'-]+)\b",
+    )
+)
+
+_LIKE_PATTERNS = tuple(
+    re.compile(p, re.IGNORECASE)
+    for p in (
+        r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?like\s+(?P<val>.+)$",
+        r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?love\s+(?P<val>.+)$",
+        r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?enjoy\s+(?P<val>.+)$",
+        r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?prefer\s+(?P<val>.+)$",
+        r"\bi(?:'|\s+a)m\s+into\s+(?P<val>.+)$",
+        r"\bi\s+am\s+into\s+(?P<val>.+)$",
+        r"\bmy\s+favou?rite\b[^\n]{0,32}\b(?:is|are)\s+(?P<val>.+)$",
+    )
+)
+
+_DISLIKE_PATTERNS = tuple(
+    re.compile(p, re.IGNORECASE)
+    for p in (
+        r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?(?:dislike|disliked|hate|hated|can't\s+stand|cannot\s+stand)\s+(?P<val>.+)$",
+        r"\bi\s+(?P<pre>(?:[\w']+\s+){0,3})?(?:don't|do\s+not|can't|cannot)\s+(?P<mid>(?:[\w']+\s+){0,3})?like\s+(?P<val>.+)$",
+    )
+)
+
+# Language mentions, checked in order (English wins if both appear). Case-insensitive
+# search instead of lowercasing the whole message first.
+_LANGUAGE_PATTERNS = (
+    (re.compile("english", re.IGNORECASE), "English"),
+    (re.compile("danish", re.IGNORECASE), "Danish"),
+)
+
+# Negations in the words between "I" and the verb (matched against lowercased text).
+_LIKE_NEGATION_RE = re.compile(r"\b(don't|do\s+not|didn't|did\s+not|can't|cannot|not|never)\b")
+_DISLIKE_NEGATION_RE = re.compile(r"\b(don't|do\s+not|not|never)\b")
+
+_CONNECTIVE_VERB_PREFIX_RE = re.compile(
+    r"^(and|or)\s+(hate|hated|dislike|disliked|love|loved|like|liked|enjoy|enjoyed|prefer|preferred)\b"
+)
+
+_SESSION_ITEM_RE = re.compile(r"\b(this|that)\s+(answer|response|message|idea|suggestion|one)\b", re.IGNORECASE)
+
+_GENERIC_PRAISE_RE = re.compile(r"\bthat\s+(was|is)\s+(nice|good|great|cool|awesome|amazing)\b")
@@ -0,0 +1,52 @@
+"""Unit tests for emotion.py."""
+
+import pytest
+from unittest.mock import patch
+
+
+# =========================
+# Tests for emotion.py
+# =========================
+
+class TestEmotionEngine:
+    """Tests for EmotionEngine class."""
+
+    def test_replay_matches_apply_and_decay(self):
+        """replay() should reach the same state as apply() calls spaced by the same gaps."""
+        import emotion
+        from emotion import EmotionEngine
+
+        # (dt_seconds, valence, arousal, dominance, confidence); gaps >= 1s use exact decay
+        events = [
+            (0.0, 0.6, 0.3, 0.1, 1.0),
+            (5.0, -0.4, 0.5, -0.2, 0.8),
+            (42.0, 0.9, -0.1, 0.3, 0.5),
+            (1.5, -1.0, 1.0, -1.0, 1.0),
+            (300.0, 0.2, 0.2, 0.2, 0.3),
+        ]
+        clock = [1000.0]
+
+        with patch.object(emotion.time, "time", side_effect=lambda: clock[0]):
+            applied = EmotionEngine()
+            for dt, dv, da, dd, conf in events:
+                clock[0] += dt
+                applied.apply({"valence": dv, "arousal": da, "dominance": dd, "confidence": conf})
+
+            replayed = EmotionEngine()
+            replayed.replay(events)
+
+        for layer in ("_emotion", "_baseline"):
+            got = getattr(replayed, layer)
+            want = getattr(applied, layer)
+            assert got.valence == pytest.approx(want.valence, abs=1e-9)
+            assert got.arousal == pytest.approx(want.arousal, abs=1e-9)
+            assert got.dominance == pytest.approx(want.dominance, abs=1e-9)
+        assert replayed.label() == applied.label()
+
+
+# =========================
+# Run tests
+# =========================
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,93 @@
+"""Unit tests for humanize.py."""
+
+import pytest
+
+
+# =========================
+# Tests for humanize.py
+# =========================
+
+class TestKeywordSignals:
+    """extract_constraints() / is_ambiguous() share one keyword scan; outputs match the original per-keyword checks."""
+
+    def test_extract_constraints(self):
+        """Constraints come out in the fixed order, once each, for every keyword spelling."""
+        from humanize import extract_constraints
+
+        cases = {
+            "keep p225 but make it deeper": ["keep p225", "make it deeper"],
+            "Make the voice WARMER and lower": ["make it deeper", "make it warmer"],
+            "warmup the tts": ["make it warmer"],
+            "show code, not files": ["show code only"],
+            "code only, no file please": ["show code only"],
+            "log the mood on the same line": ["log in the same console line"],
+            "same line in the console": ["log in the same console line"],
+            "deeper deeper deep": ["make it deeper"],
+            "the codebase is warm": ["make it warmer"],
+            "p225 warmup code no file same line console": [
+                "keep p225", "make it warmer", "show code only", "log in the same console line",
+            ],
+            "hello there": [],
+            "": [],
+        }
+        for text, expected in cases.items():
+            assert extract_constraints(text) == expected, text
+
+    def test_is_ambiguous(self):
+        """A pronoun-only request is ambiguous unless a known target is mentioned (substring match)."""
+        from humanize import is_ambiguous
+
+        cases = {
+            "fix it": True,
+            "make it better": True,
+            "change it please": True,
+            "can you update it?": True,
+            "what is this": True,
+            "make   it work": True,
+            "fix the tts": False,
+            "make it louder in the voice": False,
+            "update the logs": False,
+            "it broke the command": False,
+            "they said the module is fine": False,
+            "this pitch is off": False,
+            "fixit": False,
+            "hello": False,
+            "": False,
+        }
+        for text, expected in cases.items():
+            assert is_ambiguous(text) is expected, text
+
+
+class TestInferIntent:
+    """infer_intent() dispatches on the first character; results match the original prefix loop."""
+
+    def test_infer_intent(self):
+        """Prefixes win over a trailing '?', and text is stripped + lowercased first."""
+        from humanize import infer_intent
+
+        cases = {
+            "How do I install it?": "how_to",
+            "how to fix the log": "how_to",
+            "Can you make it deeper?": "request_change",
+            "could you change the voice": "request_change",
+            "  Please update the module": "request_change",
+            "change it": "request_change",
+            "why does it crash": "explain",
+            "Explain the warmup": "general",
+            "what is p225?": "question",
+            "is this ok?": "question",
+            "what?": "question",
+            "?": "question",
+            "hello": "general",
+            "": "general",
+        }
+        for text, expected in cases.items():
+            assert infer_intent(text) == expected, text
+
+
+# =========================
+# Run tests
+# =========================
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
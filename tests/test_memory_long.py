@@ -0,0 +1,120 @@
+"""Unit tests for personality/memory_long.py."""
+
+import pytest
+import asyncio
+import json
+import sqlite3
+import threading
+
+
+# =========================
+# Tests for personality/memory_long.py
+# =========================
+
+class TestLongTermMemory:
+    """Tests for Long_Term_Memory class."""
+
+    @pytest.fixture
+    def memory_long(self, tmp_path, monkeypatch):
+        """memory_long module wired to a throwaway SQLite store and snapshot dir."""
+        monkeypatch.chdir(tmp_path)  # the module opens memory/memory.db on import
+        import personality.memory_long as memory_long
+        from memory_sqlite import SQLiteMemory
+
+        sql = SQLiteMemory(str(tmp_path / "memory.db"))
+        monkeypatch.setattr(memory_long, "_SQL", sql)
+        monkeypatch.setattr(memory_long, "BASE_DIR", tmp_path / "users")
+        yield memory_long
+        sql.close()
+
+    def test_save_skips_unchanged_snapshot(self, memory_long, monkeypatch):
+        """Unchanged users aren't rewritten; a failed SQLite write is retried on the next save()."""
+        sql = memory_long._SQL
+        upserts = []
+        real_upsert = sql.upsert_facts
+        fail = [False]
+
+        def counting_upsert(user_id, rows):
+            upserts.append(user_id)
+            if fail[0]:
+                raise sqlite3.OperationalError("database is locked")
+            return real_upsert(user_id, rows)
+
+        monkeypatch.setattr(sql, "upsert_facts", counting_upsert)
+
+        mem = memory_long.Long_Term_Memory(7)
+        assert len(upserts) == 1
+        written = mem.file_path.stat().st_mtime_ns
+
+        # Reloading an unchanged user and saving again touch neither store
+        mem = memory_long.Long_Term_Memory(7)
+        mem.save()
+        assert len(upserts) == 1
+        assert mem.file_path.stat().st_mtime_ns == written
+
+        fail[0] = True
+        mem.data["name"] = "Sam"
+        mem.save()
+        assert len(upserts) == 2
+        assert "name" not in sql.get_facts(7)
+
+        fail[0] = False
+        mem.save()
+        assert len(upserts) == 3
+        assert sql.get_facts(7)["name"] == "Sam"
+
+    @pytest.mark.asyncio
+    async def test_extraction_reloads_facts_on_the_loop(self, memory_long, monkeypatch):
+        """Facts extracted on a worker thread reach the cached instance without the thread saving it."""
+        sql = memory_long._SQL
+        monkeypatch.setattr(sql, "should_extract", lambda *args, **kwargs: True)
+
+        saved_from = []
+        real_save = memory_long.Long_Term_Memory.save
+
+        def recording_save(self):
+            saved_from.append(threading.current_thread())
+            real_save(self)
+
+        monkeypatch.setattr(memory_long.Long_Term_Memory, "save", recording_save)
+
+        mem = memory_long.Long_Term_Memory(42)
+        mem.record_message("user", "call me Robin")
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def mock_ask_llama(messages):
+            started.set()
+            release.wait(timeout=5.0)
+            return json.dumps({"facts": [{"key": "name", "value": "Robin", "confidence": 0.9}], "episodes": []})
+
+        task = asyncio.create_task(mem.extract_in_background(mock_ask_llama))
+        await asyncio.to_thread(started.wait, 5.0)
+
+        # The loop keeps changing and saving the instance while extraction runs
+        for enabled in (True, False, True):
+            mem.data["voice_enabled"] = enabled
+            mem.save()
+        release.set()
+        await asyncio.wait_for(task, timeout=5.0)
+
+        assert saved_from and all(t is threading.main_thread() for t in saved_from)
+        assert mem.data["name"] == "Robin"
+        assert mem.data["voice_enabled"] is True
+
+        facts = sql.get_facts(42)
+        assert facts["name"] == "Robin"
+        assert facts["voice_enabled"] == "1"
+
+        snapshot = json.loads(mem.file_path.read_text(encoding="utf-8"))
+        assert snapshot["name"] == "Robin"
+        assert snapshot["voice_enabled"] is True
+
+
+# =========================
+# Run tests
+# =========================
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,226 @@
+"""Unit tests for memory_sqlite.py."""
+
+import pytest
+import tempfile
+import os
+import sqlite3
+
+
+def _legacy_db(path, episodes, with_embedding=False):
+    """Create an unversioned memory DB holding only the original episodes columns.
+
+    `episodes` rows are (user_id, ts, text, tags, importance[, embedding]).
+    """
+    columns = ["user_id", "ts", "text", "tags", "importance"] + (["embedding"] if with_embedding else [])
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """
+        CREATE TABLE episodes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            tags TEXT NOT NULL DEFAULT '',
+            importance REAL NOT NULL DEFAULT 0.5
+        )
+        """
+    )
+    if with_embedding:
+        conn.execute("ALTER TABLE episodes ADD COLUMN embedding BLOB DEFAULT NULL")
+    conn.executemany(
+        f"INSERT INTO episodes({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        episodes,
+    )
+    conn.commit()
+    conn.close()
+
+
+# =========================
+# Tests for memory_sqlite.py
+# =========================
+
+class TestSQLiteMemory:
+    """Tests for SQLiteMemory class."""
+
+    def test_add_episodes_invalidates_retrieval_cache(self):
+        """A cached retrieve_relevant() result should not survive add_episodes()."""
+        from memory_sqlite import SQLiteMemory
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mem = SQLiteMemory(os.path.join(tmpdir, "memory.db"))
+            try:
+                mem.add_episodes(1, [("user likes pizza", ["food"], 0.5, None)])
+                first = mem.retrieve_relevant(1, "favourite pizza")
+                assert [ep.text for ep in first] == ["user likes pizza"]
+                # Served from the cache while nothing changed
+                assert [ep.id for ep in mem.retrieve_relevant(1, "favourite pizza")] == [first[0].id]
+
+                mem.add_episodes(1, [("user orders pizza on fridays", ["food"], 0.5, None)])
+                texts = {ep.text for ep in mem.retrieve_relevant(1, "favourite pizza")}
+                assert texts == {"user likes pizza", "user orders pizza on fridays"}
+            finally:
+                mem.close()
+
+    def test_migrates_legacy_episode_columns(self):
+        """An unversioned DB gains the usage/embedding columns once, tracked in user_version."""
+        from memory_sqlite import SQLiteMemory
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "memory.db")
+            _legacy_db(path, [("1", 100, "user likes tea", "drink", 0.4)])
+
+            mem = SQLiteMemory(path)
+            try:
+                columns = {row["name"] for row in mem.conn.execute("PRAGMA table_info(episodes)")}
+                assert {"times_used", "last_used_ts", "embedding"} <= columns
+                row = mem.conn.execute("SELECT text, times_used, last_used_ts, embedding FROM episodes").fetchone()
+                assert tuple(row) == ("user likes tea", 0, 0, None)
+                version = mem.conn.execute("PRAGMA user_version").fetchone()[0]
+                assert version >= 1
+            finally:
+                mem.close()
+
+            # Reopening an up-to-date DB is a no-op
+            mem = SQLiteMemory(path)
+            try:
+                assert mem.conn.execute("PRAGMA user_version").fetchone()[0] == version
+                assert mem.conn.execute("SELECT count(*) FROM episodes").fetchone()[0] == 1
+            finally:
+                mem.close()
+
+
+    def test_migration_backfills_keyword_tokens(self):
+        """Legacy episodes get their stored keyword tokens and are found by keyword retrieval."""
+        from memory_sqlite import SQLiteMemory, _episode_tokens_str
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "memory.db")
+            _legacy_db(path, [
+                ("1", 100, "User plays Chess on weekends", "hobby, games", 0.6),
+                ("1", 200, "user dislikes mornings", "", 0.5),
+            ])
+
+            mem = SQLiteMemory(path)
+            try:
+                rows = mem.conn.execute("SELECT text, tags, tokens FROM episodes ORDER BY id").fetchall()
+                for row in rows:
+                    assert row["tokens"] == _episode_tokens_str(row["text"], row["tags"])
+                assert "chess" in rows[0]["tokens"].split()
+                assert mem.conn.execute("PRAGMA user_version").fetchone()[0] >= 2
+
+                found = mem.retrieve_relevant(1, "any chess games?")
+                assert [ep.text for ep in found] == ["User plays Chess on weekends"]
+            finally:
+                mem.close()
+
+
+    def test_migration_reencodes_float32_embeddings_as_int8(self):
+        """Legacy float32 embeddings become unit-length int8 blobs; int8 ones are left alone."""
+        np = pytest.importorskip("numpy")
+        import memory_vector
+        from memory_sqlite import SQLiteMemory
+
+        legacy = np.array([3.0, -4.0, 0.5, 12.0], dtype=np.float32)
+        quantized = memory_vector.embedding_to_blob([0.1, 0.2, 0.3, 0.4])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "memory.db")
+            _legacy_db(path, [
+                ("1", 100, "legacy vector", "", 0.5, legacy.tobytes()),
+                ("1", 200, "already int8", "", 0.5, quantized),
+                ("1", 300, "never embedded", "", 0.5, None),
+            ], with_embedding=True)
+
+            mem = SQLiteMemory(path)
+            try:
+                blobs = [row[0] for row in mem.conn.execute("SELECT embedding FROM episodes ORDER BY id")]
+                assert mem.conn.execute("PRAGMA user_version").fetchone()[0] == 3
+            finally:
+                mem.close()
+
+        assert memory_vector.is_quantized_blob(blobs[0])
+        restored = memory_vector.blob_to_numpy(blobs[0])
+        unit = legacy / np.linalg.norm(legacy)
+        assert np.linalg.norm(restored) == pytest.approx(1.0, abs=1e-2)
+        assert float(restored @ unit) > 0.999
+        assert blobs[1] == quantized
+        assert blobs[2] is None
+
+
+    def test_fts_retrieval_matches_full_scan(self):
+        """Keyword retrieval through the FTS index picks the same episodes as scanning them all."""
+        from memory_sqlite import SQLiteMemory
+        from utils.helpers import now_ts
+
+        topics = ["pizza", "python", "hiking", "jazz", "chess", "coffee"]
+        queries = [
+            "do you remember my pizza order",
+            "python or chess tonight?",
+            "JAZZ and coffee",
+            "hiking trip with pizza and coffee",
+            "nothing relevant here",
+        ]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mem = SQLiteMemory(os.path.join(tmpdir, "memory.db"))
+            try:
+                if not mem._fts:
+                    pytest.skip("SQLite build without FTS5")
+                now = now_ts()
+                for i in range(30):
+                    words = [topics[i % 6], topics[(i * 5 + 1) % 6]]
+                    mem.add_episode(
+                        1, f"user talked about {words[0]} and {words[1]} ({i})",
+                        tags=[words[1]], importance=(i % 4) / 4, ts=now - (i % 7) * 86400, embed=False,
+                    )
+                mem.add_episode(2, "other user loves pizza and jazz", embed=False)
+
+                for query in queries:
+                    with_fts = [ep.id for ep in mem.retrieve_relevant(1, query, limit=6)]
+                    mem._fts = False
+                    mem._retrieval_cache.clear()
+                    scanned = [ep.id for ep in mem.retrieve_relevant(1, query, limit=6)]
+                    mem._fts = True
+                    mem._retrieval_cache.clear()
+                    assert with_fts == scanned, query
+            finally:
+                mem.close()
+
+
+    def test_prune_keeps_newest_rows_by_ts_then_id(self):
+        """prune() keeps each user's newest rows, breaking equal timestamps by id."""
+        from memory_sqlite import SQLiteMemory
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mem = SQLiteMemory(os.path.join(tmpdir, "memory.db"))
+            try:
+                for i, ts in enumerate([100, 100, 100, 200, 200, 300]):
+                    mem.add_episode(1, f"episode {i}", ts=ts, embed=False)
+                    mem.add_message(1, "user", f"message {i}", ts=ts)
+                mem.add_episode(2, "other user episode", ts=50, embed=False)
+
+                def texts(table, column, uid="1"):
+                    rows = mem.conn.execute(f"SELECT {column} FROM {table} WHERE user_id=? ORDER BY id", (uid,))
+                    return [row[0] for row in rows]
+
+                mem.prune(1, keep_episodes=10, keep_messages=10)
+                assert len(texts("episodes", "text")) == 6
+
+                mem.prune(1, keep_episodes=4, keep_messages=2)
+                assert texts("episodes", "text") == ["episode 2", "episode 3", "episode 4", "episode 5"]
+                assert texts("messages", "content") == ["message 4", "message 5"]
+                assert texts("episodes", "text", uid="2") == ["other user episode"]
+
+                mem.prune(1, keep_episodes=0, keep_messages=0)
+                assert texts("episodes", "text") == []
+                assert texts("messages", "content") == []
+            finally:
+                mem.close()
+
+
+# =========================
+# Run tests
+# =========================
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
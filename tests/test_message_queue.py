@@ -0,0 +1,146 @@
+"""Unit tests for message_queue.py."""
+
+import pytest
+import asyncio
+from unittest.mock import MagicMock, patch
+
+
+def _msg(user_id, channel_id=123):
+    """Mock Discord message from user_id in channel_id."""
+    mock_msg = MagicMock()
+    mock_msg.channel.id = channel_id
+    mock_msg.author.id = user_id
+    return mock_msg
+
+
+class TestMessageQueue:
+    """Tests for MessageQueue class."""
+
+    @pytest.mark.asyncio
+    async def test_coalesce_merges_same_priority_in_arrival_order(self):
+        """Queued same-priority messages from one conversation merge in arrival order, up to coalesce_max."""
+        from message_queue import MessageQueue, Priority
+
+        queue = MessageQueue(max_size=20, coalesce_max=3)
+        received = []
+        gate = asyncio.Event()
+        done = asyncio.Event()
+
+        async def mock_handler(msg, text, raw_content):
+            received.append((msg, text, raw_content))
+            if text == "first":
+                await gate.wait()
+            if len(received) == 6:
+                done.set()
+
+        await queue.start_worker(mock_handler)
+        await queue.enqueue(_msg(1), "first")
+        await asyncio.sleep(0.01)  # worker is now blocked in the handler
+
+        msg_u = _msg(1)
+        await queue.enqueue(_msg(1), "x", raw_content="x")
+        await queue.enqueue(_msg(2), "y", raw_content="y")
+        await queue.enqueue(_msg(1), "z", Priority.LOW, raw_content="z")
+        await queue.enqueue(_msg(1), "w", Priority.HIGH, raw_content="w")
+        await queue.enqueue(_msg(1), "v", raw_content="v")
+        await queue.enqueue(msg_u, "u", raw_content="u")
+        await queue.enqueue(_msg(1), "t", raw_content="t")
+        gate.set()
+
+        await asyncio.wait_for(done.wait(), timeout=1.0)
+        await queue.stop_worker()
+
+        # HIGH and LOW messages are not folded into the NORMAL batch
+        assert [text for _, text, _ in received] == ["first", "w", "x\nv\nu", "y", "t", "z"]
+        # The merged request replies to the newest message it contains
+        assert received[2][0] is msg_u
+        assert received[2][2] == "x\nv\nu"
+        assert queue.size == 0
+
+    @pytest.mark.asyncio
+    async def test_aging_promotes_low_priority(self):
+        """A LOW message that waited 2 * aging_s goes ahead of later HIGH ones."""
+        from message_queue import MessageQueue, Priority
+
+        clock = [1000.0]
+        received = []
+        done = asyncio.Event()
+
+        async def mock_handler(msg, text, raw_content):
+            received.append(text)
+            if len(received) == 3:
+                done.set()
+
+        with patch("message_queue.time", side_effect=lambda: clock[0]):
+            queue = MessageQueue(max_size=20, coalesce_max=1, aging_s=10.0)
+            await queue.enqueue(_msg(1), "low", Priority.LOW)
+            clock[0] += 25.0  # LOW (3) -> HIGH (1)
+            await queue.enqueue(_msg(2), "high", Priority.HIGH)
+            await queue.enqueue(_msg(3), "critical", Priority.CRITICAL)
+
+            await queue.start_worker(mock_handler)
+            await asyncio.wait_for(done.wait(), timeout=1.0)
+            await queue.stop_worker()
+
+        # Ties at HIGH go by arrival order
+        assert received == ["critical", "low", "high"]
+
+    @pytest.mark.asyncio
+    async def test_full_queue_sheds_newest_lower_priority(self):
+        """When full, a higher-priority message evicts the newest of the lowest-priority ones."""
+        from message_queue import MessageQueue, Priority
+
+        queue = MessageQueue(max_size=3)
+
+        assert await queue.enqueue(_msg(1), "low1", Priority.LOW)
+        assert await queue.enqueue(_msg(2), "low2", Priority.LOW)
+        assert await queue.enqueue(_msg(3), "normal")
+        assert await queue.enqueue(_msg(4), "high", Priority.HIGH)
+
+        assert sorted(entry[2].user_text for entry in queue._heap) == ["high", "low1", "normal"]
+        assert queue.dropped_count == 1
+
+        # Nothing below LOW to shed: a LOW message is dropped after admit_timeout
+        assert not await queue.enqueue(_msg(5), "low3", Priority.LOW, admit_timeout=0.01)
+        assert queue.size == 3
+        assert queue.dropped_count == 2
+
+    @pytest.mark.asyncio
+    async def test_blocked_conversation_not_reordered(self):
+        """A user's later messages wait for their earlier one instead of overtaking it."""
+        from message_queue import MessageQueue, Priority
+
+        queue = MessageQueue(max_size=20, n_workers=2, handler_concurrency=1)
+        received = []
+        gate = asyncio.Event()
+        done = asyncio.Event()
+
+        async def mock_handler(msg, text, raw_content):
+            received.append(text)
+            if text == "hi":
+                await gate.wait()
+            if len(received) == 3:
+                done.set()
+
+        await queue.enqueue(_msg(2), "hi", Priority.HIGH)
+        await queue.enqueue(_msg(1), "a0")
+        await queue.start_worker(mock_handler)
+        await asyncio.sleep(0.01)  # "hi" holds the only handler slot
+
+        await queue.enqueue(_msg(1), "a1")
+        await queue.enqueue(_msg(3), "x")
+        await queue.enqueue(_msg(1), "a2")
+        gate.set()
+
+        await asyncio.wait_for(done.wait(), timeout=1.0)
+        await queue.stop_worker()
+
+        assert received == ["hi", "a0\na1\na2", "x"]
+
+
+# =========================
+# Run tests
+# =========================
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])